@@ -59,6 +59,10 @@ def main():
         surface.main(argv=argv)
 
     elif args['<command>'] == 'electrostatics':
+        if len(args['<args>']) > 0 and args['<args>'][0] == 'batch':
+            from .electrostatics import batch
+            batch.main(argv=argv)
+            return
         from .electrostatics import surface_electrostatics
         surface_electrostatics.main(argv=argv)
 
@@ -7,11 +7,13 @@ Usage:
                    [(--backbone_rmsd FILE --backbone_rg FILE)]
                    [(--c_alpha_rmsd FILE --c_alpha_rg FILE)]
                    [(--rmsf "FILES" <begin> <end>)]
-                   [(--trajectory FILE --structure FILE) -c <int> -a <list>]
+                   [(--trajectory FILE --structure FILE) -c <int> -a <list> [-j <int>]]
+                   [--sd_block <ns>]
                    [--dipoles FILE]
                    [--ss FILE]
                    [(--sasa "FILES")]
                    [--info JSON]
+                   [--cache] [--workers <int>]
                    HDF_FILE
 
   md_davis collect -h | --help
@@ -34,8 +36,13 @@ Options:
   -d, --dipoles FILE        Add dipole_moment into the HDF_FILE
   -t, --trajectory FILE     MD trajectory file
   -s, --structure FILE      Structure file, preferably in PDB format
-  -c, --chunk <int>         Number of frames to read at once [default: 0]
+  -c, --chunk <int>         Number of frames to read at once, 0 to read the
+                            whole trajectory at once [default: 1000]
   -a, --atoms <list>        Atoms to use for dihedral calculation [default: None]
+  -j, --jobs <int>          Number of processes for dihedral calculation
+                            [default: 1]
+  --sd_block <ns>           Also evaluate the dihedral standard deviation
+                            in consecutive blocks of this length
   --sasa FILES              Add SASA into the HDF_FILE
   --ss FILE                 Add secondary sctructure information from
                             'gmx do_dssp' into HDF_FILE
@@ -44,6 +51,10 @@ Options:
 
   -i, --info JSON           Add labels and other information as attributes
                             in the HDF_FILE
+  --cache                   Cache the data parsed from .xvg files next to
+                            them and reuse it if the files are unchanged
+  -w, --workers <int>       Number of processes reading the input files
+                            concurrently [default: 1]
 
 The attributes resuired as JSON with '--info' are given in the example below:
 
@@ -61,19 +72,35 @@ The attributes resuired as JSON with '--info' are given in the example below:
 This information is primarily parsed to create labels for plots with
 this data file. 'sequence' is required to split the data into
 chains. A JSON file can also be supplied instead of a string
+
+The path, size, modification time and SHA-1 hash of every input file is
+stored with its data, along with the options used for it (--comment, the
+RMSF <begin> and <end>, --atoms and --sd_block). When 'md_davis collect'
+is run again on the same HDF_FILE, inputs whose files and options are
+unchanged are skipped. If only --sd_block changed, the standard deviation
+in blocks is evaluated from the stored dihedrals. For changed inputs, the
+new frames are appended to RMSD, Rg, dipole moment and dihedral datasets
+if the stored frames are the first frames of the input, while other
+datasets and those whose stored frames differ from the input are replaced.
 """
 
 import os
 import collections
+import concurrent.futures
+import functools
+import math
+import hashlib
 import json
+import multiprocessing
 import statistics
 import h5py
 import docopt
 import mdtraj
 import numpy
-import scipy.stats
 import warnings
 
+from .utils.xvg import loadxvg
+
 SECSTR_CODES = {'H':'α-helix',
                 'G':'3_10-helix',
                 'I':'π-helix',
@@ -127,36 +154,229 @@ def add_info(hdf_file, info):
         hdf_file.attrs[key] = value
 
 
-def add_rmsd_rg(hdf_file, rmsd, rg, dataset='all_atom',
-    comment=None,
-    time_unit='picosecond', unit='nanometer'):
-    """ Make RMSD & Rg dataset in HDF5 file """
-    group = hdf_file.require_group('rmsd_rg')
-    group.attrs['comment'] = comment if comment else 'RMSD was calculated with respect to last frame'
+@functools.lru_cache()
+def file_hash(filename, size, mtime):
+    """ SHA-1 of the contents of a file, computed once per size and mtime """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as in_file:
+        for block in iter(lambda: in_file.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def file_prefix_hash(filename, size):
+    """ SHA-1 of the first size bytes of a file """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as in_file:
+        while size > 0:
+            block = in_file.read(min(size, 1 << 20))
+            if not block:
+                break
+            sha1.update(block)
+            size -= len(block)
+    return sha1.hexdigest()
+
+
+def file_signature(filename):
+    """ Path, size, modification time and content hash of a file """
+    stat = os.stat(filename)
+    return {'path': os.path.abspath(filename),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': file_hash(os.path.abspath(filename), stat.st_size, stat.st_mtime),
+    }
+
+
+def record_sources(obj, filenames, parameters=None):
+    """ Store the signatures of the input files, and the parameters used
+        for the data, as an attribute
+    """
+    sources = {role: file_signature(filename) for role, filename in filenames.items()}
+    if parameters is not None:
+        sources['parameters'] = parameters
+    obj.attrs['sources'] = json.dumps(sources)
+
+
+def recorded_parameters(obj):
+    """ Parameters recorded with the sources of obj or None """
+    if obj is None or 'sources' not in obj.attrs:
+        return None
+    return json.loads(obj.attrs['sources']).get('parameters')
+
+
+def files_changed(obj, filenames):
+    """ Check if the input files differ from those recorded in obj """
+    if obj is None or 'sources' not in obj.attrs:
+        return True
+    recorded = json.loads(obj.attrs['sources'])
+    recorded.pop('parameters', None)
+    if set(recorded) != set(filenames):
+        return True
+    for role, filename in filenames.items():
+        old = recorded[role]
+        stat = os.stat(filename)
+        if (old['path'], old['size'], old['mtime']) == \
+                (os.path.abspath(filename), stat.st_size, stat.st_mtime):
+            continue
+        if old['sha1'] != file_signature(filename)['sha1']:
+            return True
+    return False
+
+
+def sources_changed(obj, filenames, parameters=None):
+    """ Check if the input files or the parameters differ from those
+        recorded in obj
+    """
+    if files_changed(obj, filenames):
+        return True
+    # Compare as stored, e.g. tuples become lists in JSON
+    return recorded_parameters(obj) != json.loads(json.dumps(parameters))
+
+
+def extends_recorded(obj, role, filename):
+    """ Check if the file recorded for role in obj was only extended, i.e.
+        the file still starts with the recorded contents
+    """
+    if obj is None or 'sources' not in obj.attrs:
+        return False
+    old = json.loads(obj.attrs['sources']).get(role)
+    return old is not None and os.path.getsize(filename) >= old['size'] \
+        and file_prefix_hash(filename, old['size']) == old['sha1']
+
+
+def append_rows(dset, data):
+    """ Append rows to a resizable dataset along the first axis """
+    start = dset.shape[0]
+    dset.resize(start + len(data), axis=0)
+    dset[start:] = data
+
+
+def write_time_series(group, name, data, time):
+    """ Append the rows of data after those already stored to a resizable
+        dataset if the stored rows are the leading rows of data, or create
+        it if it does not exist or can not be extended
+    """
+    dset = group.get(name)
+    if dset is not None and dset.maxshape[0] is None and len(dset) <= len(data) \
+            and numpy.array_equal(data[:len(dset)], dset[...]):
+        print(f'Appending {len(data) - len(dset)} new frames to {dset.name}')
+        append_rows(dset, data[len(dset):])
+    else:
+        if dset is not None:
+            print(f'Replacing {dset.name} as its frames differ from the input')
+            del group[name]
+        dset = group.create_dataset(name, data=data,
+                                    maxshape=(None,) + data.shape[1:],
+                                    chunks=True)
+    if len(time) > 0:
+        dset.attrs['last_time'] = time.max()
+    return dset
+
+
+# An input to collect: read(**read_kwargs) parses the files in sources and
+# write(hdf_file, data, **write_kwargs) stores the result at path in the HDF file
+# An input to collect: read(**read_kwargs) parses the files in sources and
+# write(hdf_file, data, **write_kwargs) stores the result at path in the HDF
+# file. It is collected again if the files or the parameters change.
+CollectTask = collections.namedtuple('CollectTask',
+    ['path', 'sources', 'read', 'read_kwargs', 'write', 'write_kwargs', 'parameters'],
+    defaults=[None])
+
+
+def write_task(hdf_file, task, data):
+    """ Write the data read for a task and record its sources """
+    task.write(hdf_file, data, **task.write_kwargs)
+    record_sources(hdf_file[task.path], task.sources, task.parameters)
+
+
+def collect_inputs(hdf_file, tasks, workers=1, during=None):
+    """ Collect the inputs whose files changed since they were last
+        collected. With workers > 1 the files are read concurrently in a
+        process pool while this process alone writes into hdf_file, so
+        HDF5 writes are never concurrent. The callable during is run in
+        this process while the files are being read.
+    """
+    pending = []
+    for task in tasks:
+        if sources_changed(hdf_file.get(task.path), task.sources, task.parameters):
+            pending.append(task)
+        else:
+            print(f'Skipping {" ".join(task.sources.values())} as it is already in the HDF5 file.')
+    if workers > 1 and pending:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(task.read, **task.read_kwargs): task
+                       for task in pending}
+            if during:
+                during()
+            for future in concurrent.futures.as_completed(futures):
+                write_task(hdf_file, futures[future], future.result())
+    else:
+        for task in pending:
+            write_task(hdf_file, task, task.read(**task.read_kwargs))
+        if during:
+            during()
+
+
+def read_rmsd_rg(rmsd, rg, cache=False):
+    """ Read the RMSD and Rg .xvg files into a record array """
     print(f'Collecting data from {rmsd} and {rg} into HDF5 file.')
-    rmsd_data = numpy.loadtxt(rmsd, comments=('#', '@'), dtype=numpy.single)
-    rg_data = numpy.loadtxt(rg, comments=('#', '@'), dtype=numpy.single)
+    rmsd_data = loadxvg(rmsd, cache=cache)
+    rg_data = loadxvg(rg, cache=cache)
     assert numpy.array_equal(rmsd_data[:, 0], rg_data[:, 0]), \
         "The times in RMSD file do not match those in radius of gyration file"
-    data = numpy.core.records.fromarrays(numpy.hstack([rmsd_data, rg_data[:, 1:]]).T,
+    return numpy.core.records.fromarrays(numpy.hstack([rmsd_data, rg_data[:, 1:]]).T,
         names='time, rmsd, rg, rg_x, rg_y, rg_z')
-    dset = group.create_dataset(dataset, data=data)
+
+
+def write_rmsd_rg(hdf_file, data, dataset='all_atom', comment=None,
+    time_unit='picosecond', unit='nanometer'):
+    group = hdf_file.require_group('rmsd_rg')
+    group.attrs['comment'] = comment if comment else 'RMSD was calculated with respect to last frame'
+    dset = write_time_series(group, dataset, data, time=data['time'])
     dset.attrs['time_unit'] = time_unit
     dset.attrs['unit'] = unit
 
 
-def add_rmsf(hdf_file, rmsf, begin, end, unit='nanometer'):
-    group = hdf_file.require_group('rmsf')
+def rmsd_rg_task(rmsd, rg, dataset='all_atom', comment=None,
+    time_unit='picosecond', unit='nanometer', cache=False):
+    return CollectTask(path=f'rmsd_rg/{dataset}',
+                       sources={'rmsd': rmsd, 'rg': rg},
+                       read=read_rmsd_rg,
+                       read_kwargs=dict(rmsd=rmsd, rg=rg, cache=cache),
+                       write=write_rmsd_rg,
+                       write_kwargs=dict(dataset=dataset, comment=comment,
+                                         time_unit=time_unit, unit=unit),
+                       parameters=dict(comment=comment),
+    )
+
+
+def add_rmsd_rg(hdf_file, rmsd, rg, dataset='all_atom',
+    comment=None,
+    time_unit='picosecond', unit='nanometer', cache=False):
+    """ Make RMSD & Rg dataset in HDF5 file """
+    collect_inputs(hdf_file, [rmsd_rg_task(rmsd, rg, dataset=dataset, comment=comment,
+                                           time_unit=time_unit, unit=unit, cache=cache)])
+
+
+def read_rmsf(rmsf, cache=False):
+    """ Read the RMSF .xvg files and split them into chains """
     if isinstance(rmsf, list) and len(rmsf) > 1:
         rmsf_split_by_chains = []
         for xvg_file in rmsf:
-            rmsf_data = numpy.loadtxt(xvg_file, comments=('#', '@'), dtype=numpy.single)
+            rmsf_data = loadxvg(xvg_file, cache=cache)
             rmsf_split_by_chains.append(rmsf_data)
     elif isinstance(rmsf, list) and len(rmsf) == 1:
-        rmsf_data = numpy.loadtxt(rmsf[0], comments=('#', '@'), dtype=numpy.single)
+        rmsf_data = loadxvg(rmsf[0], cache=cache)
         rmsf_split_by_chains = split_increasing(rmsf_data.T)
     else:
         raise TypeError
+    return rmsf_split_by_chains
+
+
+def write_rmsf(hdf_file, rmsf_split_by_chains, begin, end, unit='nanometer'):
+    if 'rmsf' in hdf_file:
+        del hdf_file['rmsf']
+    group = hdf_file.require_group('rmsf')
     for ch, chain_rmsf in enumerate(rmsf_split_by_chains):
         group.create_dataset(f'chain {ch}', data=chain_rmsf)
     group.attrs['unit'] = unit
@@ -164,88 +384,367 @@ def add_rmsf(hdf_file, rmsf, begin, end, unit='nanometer'):
     group.attrs['end'] = f'{end} ns'
 
 
+def rmsf_task(rmsf, begin, end, unit='nanometer', cache=False):
+    return CollectTask(path='rmsf',
+                       sources={f'rmsf {i}': xvg_file for i, xvg_file in enumerate(rmsf)},
+                       read=read_rmsf,
+                       read_kwargs=dict(rmsf=rmsf, cache=cache),
+                       write=write_rmsf,
+                       write_kwargs=dict(begin=begin, end=end, unit=unit),
+                       parameters=dict(begin=begin, end=end),
+    )
+
+
+def add_rmsf(hdf_file, rmsf, begin, end, unit='nanometer', cache=False):
+    collect_inputs(hdf_file, [rmsf_task(rmsf, begin, end, unit=unit, cache=cache)])
+
+
+def read_dssp_matrix(filename):
+    """ Read the secondary structure strings from the .dat file of
+        gmx do_dssp into a frames x characters uint8 matrix
+    """
+    with open(filename, 'rb') as dat_file:
+        next(dat_file)
+        lines = dat_file.read().split()
+    if not lines:
+        return numpy.zeros((0, 0), dtype=numpy.uint8)
+    assert len(set(map(len, lines))) <= 1 , \
+        "The length of the secondary structure strings are not equal. Please check your input .dat file."
+    return numpy.frombuffer(b''.join(lines), dtype=numpy.uint8).reshape(len(lines), -1)
+
+
 def parse_dssp(filename):
     """ Parse the DSSP data file """
-    secondary_structure = []
-    with open(filename, 'r') as dat_file:
-        next(dat_file)
-        for line in dat_file:
-            secondary_structure.append(line.strip().split('='))
-    output = []
-    for chain in zip(*secondary_structure):
-        assert len(set([len(_) for _ in chain])) <= 1 , \
-            "The length of the secondary structure strings are not equal. Please check your input .dat file."
-        output.append(numpy.array([list(_) for _ in chain], dtype=f'S1'))
-    return output
+    matrix = read_dssp_matrix(filename)
+    # Chains are separated by '=' at the same position in every frame
+    separators = numpy.flatnonzero(matrix[0] == ord('=')) if len(matrix) else []
+    assert numpy.array_equal(numpy.count_nonzero(matrix == ord('='), axis=1),
+                             numpy.full(len(matrix), len(separators))) \
+        and (matrix[:, separators] == ord('=')).all(), \
+        "The length of the secondary structure strings are not equal. Please check your input .dat file."
+    bounds = [-1] + list(separators) + [matrix.shape[1]]
+    return [numpy.ascontiguousarray(matrix[:, start + 1:end]).view('S1')
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
 
+# Number of frames in each chunk of the stored DSSP data
+DSSP_CHUNK_FRAMES = 1000
 
 def ss_count_per_residue(chain_dssp_data):
     """ Evaluate secondary structure counts per residue """
     ss_dtype = [(_, numpy.uint32) for _ in SECSTR_CODES.keys()]
-    output = numpy.zeros(len(chain_dssp_data.T), dtype=ss_dtype)
-    for resSeq, residue in enumerate(chain_dssp_data.T):
-        counts = numpy.unique(residue, return_counts=True)
-        for structure, count in zip(*counts):
-            output[structure.decode('ascii')][resSeq] = count
+    frames = numpy.asarray(chain_dssp_data).view(numpy.uint8)
+    num_residues = frames.shape[1] if frames.ndim == 2 else 0
+    output = numpy.zeros(num_residues, dtype=ss_dtype)
+    # Comparing the bytes with one code at a time only needs a boolean
+    # array of the size of the data
+    for structure in SECSTR_CODES:
+        output[structure] = numpy.count_nonzero(frames == ord(structure), axis=0)
     return output
 
 
-def add_dssp(hdf_file, dssp):
-    """ Add the secondary structure data exhibited by each residue in
-        the output of gmx do_dssp
+def read_dssp(dssp):
+    """ Parse the output of gmx do_dssp and count the secondary
+        structures of each residue
     """
+    dssp_data = parse_dssp(dssp)
+    return dssp_data, [ss_count_per_residue(_) for _ in dssp_data]
+
+
+def write_dssp(hdf_file, data):
+    dssp_data, ss_counts = data
+    if 'secondary_structure' in hdf_file:
+        del hdf_file['secondary_structure']
     dssp_group = hdf_file.require_group('secondary_structure/dssp_data')
     ss_counts_group = hdf_file.require_group('secondary_structure/counts_per_residue')
-    dssp_data = parse_dssp(dssp)
-    for ch, chain_dssp_data in enumerate(dssp_data):
-        dssp_group.create_dataset(f'chain {ch}', data=chain_dssp_data)
-        ss_counts_group.create_dataset(f'chain {ch}',
-            data=ss_count_per_residue(chain_dssp_data)
+    for ch, (chain_dssp_data, chain_counts) in enumerate(zip(dssp_data, ss_counts)):
+        # Chunked along frames so that windows of frames can be read alone
+        dssp_group.create_dataset(f'chain {ch}', data=chain_dssp_data,
+            chunks=(min(len(chain_dssp_data), DSSP_CHUNK_FRAMES), chain_dssp_data.shape[1])
+                   if chain_dssp_data.size else None,
+            compression='gzip' if chain_dssp_data.size else None,
+            shuffle=bool(chain_dssp_data.size),
         )
+        ss_counts_group.create_dataset(f'chain {ch}', data=chain_counts)
+
 
+def dssp_task(dssp):
+    return CollectTask(path='secondary_structure',
+                       sources={'dssp': dssp},
+                       read=read_dssp,
+                       read_kwargs=dict(dssp=dssp),
+                       write=write_dssp,
+                       write_kwargs={},
+    )
 
-def get_dihedrals(hdf_file, trajectory, structure, chunk=1000, atoms=None):
-    """ Evaluate the dihedral angles using MDTraj and store it as HDF5 dataset """
-    # if atoms:
-    #     trj_iterator = mdtraj.iterload(trajectory, top=structure, chunk=chunk, atom_indices=atoms)
-    # else:
-    #     trj_iterator = mdtraj.iterload(trajectory, top=structure, chunk=chunk)
-    trj_iterator = mdtraj.iterload(trajectory, top=structure, chunk=chunk, atom_indices=atoms)
 
-    first_trj_chunk = next(trj_iterator)
-    phi_indices, phi = mdtraj.compute_phi(first_trj_chunk)
-    psi_indices, psi = mdtraj.compute_psi(first_trj_chunk)
-    omega_indices, omega = mdtraj.compute_omega(first_trj_chunk)
+def add_dssp(hdf_file, dssp):
+    """ Add the secondary structure data exhibited by each residue in
+        the output of gmx do_dssp
+    """
+    collect_inputs(hdf_file, [dssp_task(dssp)])
+
+DIHEDRAL_FUNCTIONS = {'phi': mdtraj.compute_phi,
+                      'psi': mdtraj.compute_psi,
+                      'omega': mdtraj.compute_omega,
+}
 
-    time, phi_array, psi_array, omega_array = [first_trj_chunk.time], [phi], [psi], [omega]
-    for trj_chunk in trj_iterator:
-        print(f'Calculating dihedrals for trajectory between {trj_chunk.time[0]} and {trj_chunk.time[-1]} ps')
-        time.append(trj_chunk.time)
-        phi_array.append( mdtraj.compute_phi(trj_chunk)[1] )
-        psi_array.append( mdtraj.compute_psi(trj_chunk)[1] )
-        omega_array.append( mdtraj.compute_omega(trj_chunk)[1] )
 
+@functools.lru_cache()
+def load_topology(structure):
+    """ Load the topology once per process """
+    return mdtraj.load_topology(structure)
+
+
+def dihedrals_in_segment(segment):
+    """ Compute the dihedrals for frames [start, stop) of a trajectory
+        in a worker process. The format must be seekable.
+    """
+    trajectory, structure, atoms, start, stop = segment
+    trj_chunk = next(mdtraj.iterload(trajectory, top=load_topology(structure),
+                                     chunk=stop - start, skip=start,
+                                     atom_indices=atoms))
+    dihedrals = {angle: compute_dihedral(trj_chunk)
+                 for angle, compute_dihedral in DIHEDRAL_FUNCTIONS.items()}
+    return trj_chunk.time, dihedrals
+
+
+# Formats in which mdtraj can seek to a frame. mdtraj.iterload ignores skip
+# for the others, e.g. PDB, so their frames are read from the beginning.
+SEEKABLE_FORMATS = ('.xtc', '.trr', '.dcd', '.nc', '.ncdf', '.netcdf', '.h5', '.binpos', '.dtr')
+
+
+def seekable(trajectory):
+    """ Check if mdtraj can start reading the trajectory at any frame """
+    return os.path.splitext(trajectory)[1].lower() in SEEKABLE_FORMATS
+
+
+def iter_chunks(trajectory, structure, chunk=1000, atoms=None, skip=0):
+    """ Yield consecutive chunks of the trajectory after the first skip
+        frames, reading and dropping the skipped frames for the formats
+        which can not seek
+    """
+    if seekable(trajectory):
+        yield from mdtraj.iterload(trajectory, top=structure, chunk=chunk,
+                                   skip=skip, atom_indices=atoms)
+        return
+    start = 0
+    for trj_chunk in mdtraj.iterload(trajectory, top=structure, chunk=chunk,
+                                     atom_indices=atoms):
+        start += len(trj_chunk)
+        if start > skip:
+            yield trj_chunk[max(skip - start + len(trj_chunk), 0):]
+
+
+def iter_dihedrals(trajectory, structure, chunk=1000, atoms=None, jobs=1, skip=0):
+    """ Yield the time and dihedrals for consecutive chunks of the trajectory
+        after the first skip frames. With jobs > 1 the trajectory is split
+        into frame ranges which are computed in a process pool and yielded
+        in frame order, if the format of the trajectory allows seeking.
+    """
+    if jobs > 1 and not seekable(trajectory):
+        warnings.warn(f'Can not seek in {trajectory}, so the dihedrals are '
+                      'computed in a single process.')
+        jobs = 1
+    if jobs > 1:
+        with mdtraj.open(trajectory) as trj_file:
+            num_frames = len(trj_file)
+        if chunk < 1:
+            chunk = max(-(-(num_frames - skip) // jobs), 1)
+        segments = [(trajectory, structure, atoms, start, min(start + chunk, num_frames))
+                    for start in range(skip, num_frames, chunk)]
+        with multiprocessing.Pool(jobs) as pool:
+            yield from pool.imap(dihedrals_in_segment, segments)
+    else:
+        for trj_chunk in iter_chunks(trajectory, structure, chunk=chunk,
+                                     atoms=atoms, skip=skip):
+            dihedrals = {angle: compute_dihedral(trj_chunk)
+                         for angle, compute_dihedral in DIHEDRAL_FUNCTIONS.items()}
+            yield trj_chunk.time, dihedrals
+
+
+# Size of the chunks in which the dihedrals are stored, so that a chunk
+# fits in the 1 MB chunk cache of h5py independent of the frames read at once
+DIHEDRAL_CHUNK_BYTES = 1 << 20
+
+
+def dihedral_chunk_rows(num_angles, dtype):
+    """ Number of frames in each stored chunk of a dihedral dataset """
+    return max(DIHEDRAL_CHUNK_BYTES // (max(num_angles, 1) * numpy.dtype(dtype).itemsize), 1)
+
+
+def get_dihedrals(hdf_file, trajectory, structure, chunk=1000, atoms=None, jobs=1,
+                  accumulators=None, append=False):
+    """ Evaluate the dihedral angles using MDTraj and store it as HDF5 dataset
+
+        Each chunk of the trajectory is appended to resizable datasets as
+        soon as it is computed, so memory use is bounded by the chunk size.
+        A chunk below 1 reads the whole trajectory at once.
+        If a dictionary of CircularAccumulator is given for the angles,
+        they are updated with every chunk. With append=True, the frames
+        already in the datasets are skipped and only the new frames of
+        the trajectory are added. Returns the time of the added frames.
+    """
     group = hdf_file.require_group('dihedrals')
-    phi_dset = group.create_dataset( 'phi', data=numpy.vstack( phi_array ) )
-    psi_dset = group.create_dataset( 'psi', data=numpy.vstack( psi_array ) )
-    omega_dset = group.create_dataset( 'omega', data=numpy.vstack( omega_array ) )
+    datasets = {}
+    skip = 0
+    if append and all(angle in group and group[angle].maxshape[0] is None
+                      for angle in DIHEDRAL_FUNCTIONS):
+        datasets = {angle: group[angle] for angle in DIHEDRAL_FUNCTIONS}
+        skip = len(group['phi'])
+    else:
+        for angle in DIHEDRAL_FUNCTIONS:
+            if angle in group:
+                del group[angle]
+    time = []
+    for chunk_time, dihedrals in iter_dihedrals(trajectory, structure,
+                                                chunk=chunk, atoms=atoms, jobs=jobs,
+                                                skip=skip):
+        print(f'Calculating dihedrals for trajectory between {chunk_time[0]} and {chunk_time[-1]} ps')
+        time.append(chunk_time)
+        for angle, (indices, values) in dihedrals.items():
+            if angle not in datasets:
+                num_angles = values.shape[1]
+                datasets[angle] = group.create_dataset(angle,
+                    shape=(0, num_angles),
+                    maxshape=(None, num_angles),
+                    dtype=values.dtype,
+                    chunks=(dihedral_chunk_rows(num_angles, values.dtype), max(num_angles, 1)),
+                    compression='gzip',
+                    shuffle=True,
+                )
+                datasets[angle].attrs['indices'] = indices.astype(numpy.int32)
+            append_rows(datasets[angle], values)
+            if accumulators and angle in accumulators:
+                accumulators[angle].add(values)
+    return numpy.hstack( time ) if time else numpy.zeros(0)
+
+
+class CircularAccumulator(object):
+    """ Running sums of the cosines and sines of angles in blocks of frames
+
+        The circular standard deviation over any window of whole blocks
+        can be evaluated from the sums, so the angles are only read once.
+        The arguments high and low have the same meaning as in
+        scipy.stats.circstd.
+    """
+
+    def __init__(self, block=1, high=2*numpy.pi, low=0):
+        self.block = block
+        self.high = high
+        self.low = low
+        self.sum_cos = None
+        self.sum_sin = None
+        self.counts = numpy.zeros(0, dtype=numpy.int64)
+        self.num_frames = 0
+
+    def add(self, angles):
+        """ Add a chunk of consecutive frames x angles """
+        angles = numpy.asarray(angles, dtype=numpy.float64)
+        if len(angles) == 0:
+            return self
+        angles = (angles - self.low) * 2 * numpy.pi / (self.high - self.low)
+        block_ids = (self.num_frames + numpy.arange(len(angles))) // self.block
+        num_blocks = block_ids[-1] + 1
+        if self.sum_cos is None:
+            self.sum_cos = numpy.zeros((0, angles.shape[1]))
+            self.sum_sin = numpy.zeros((0, angles.shape[1]))
+        if num_blocks > len(self.counts):
+            extra = num_blocks - len(self.counts)
+            self.sum_cos = numpy.vstack([self.sum_cos, numpy.zeros((extra, angles.shape[1]))])
+            self.sum_sin = numpy.vstack([self.sum_sin, numpy.zeros((extra, angles.shape[1]))])
+            self.counts = numpy.concatenate([self.counts, numpy.zeros(extra, dtype=numpy.int64)])
+        blocks, starts, counts = numpy.unique(block_ids, return_index=True, return_counts=True)
+        self.sum_cos[blocks] += numpy.add.reduceat(numpy.cos(angles), starts, axis=0)
+        self.sum_sin[blocks] += numpy.add.reduceat(numpy.sin(angles), starts, axis=0)
+        self.counts[blocks] += counts
+        self.num_frames += len(angles)
+        return self
+
+    def circstd(self, start=0, stop=None):
+        """ Circular standard deviation for frames [start, stop), which
+            must fall on block boundaries unless stop is past the last frame
+        """
+        if start % self.block or (stop is not None and stop < self.num_frames
+                                  and stop % self.block):
+            raise ValueError(f'Frames {start} to {stop} are not whole blocks '
+                             f'of {self.block} frames')
+        first = start // self.block
+        last = len(self.counts) if stop is None else -(-stop // self.block)
+        count = self.counts[first:last].sum()
+        mean_cos = self.sum_cos[first:last].sum(axis=0) / count
+        mean_sin = self.sum_sin[first:last].sum(axis=0) / count
+        resultant = numpy.minimum(numpy.hypot(mean_cos, mean_sin), 1)
+        return (self.high - self.low) / 2 / numpy.pi * numpy.sqrt(-2 * numpy.log(resultant))
+
+
+def dihedral_accumulators(block=1):
+    """ Accumulators for the dihedrals as used for the standard deviation """
+    return {angle: CircularAccumulator(block=block, high=numpy.pi)
+            for angle in DIHEDRAL_FUNCTIONS}
+
+
+def read_dihedral_accumulators(hdf_file, block=1, start=0, stop=None):
+    """ Fill the accumulators by reading frames [start, stop) of
+        /dihedrals in chunks of rows
+    """
+    accumulators = dihedral_accumulators(block=max(block, 1))
+    for angle, accumulator in accumulators.items():
+        dset = hdf_file[f'/dihedrals/{angle}']
+        stop = len(dset) if stop is None else min(stop, len(dset))
+        rows = dset.chunks[0] if dset.chunks else stop - start
+        rows = max(rows, 1)
+        for first in range(start, stop, rows):
+            accumulator.add(dset[first:min(first + rows, stop)])
+    return accumulators
+
+
+def store_dihedral_sd(dih_sd_group, lengths, circ_sd_per_angle, num_windows=None):
+    """ Split the standard deviations into chains and store them with
+        phi shifted by one residue. Windows are along the first axis
+        if num_windows is given.
+    """
+    data_type =  numpy.dtype([("phi", numpy.float64),
+                              ("psi", numpy.float64),
+                              ("omega", numpy.float64)
+                            ])
+    for ch, length in enumerate(lengths):
+        shape = (length + 1,) if num_windows is None else (num_windows, length + 1)
+        if f'chain {ch}' in dih_sd_group:
+            del dih_sd_group[f'chain {ch}']
+        dih_sd_group.create_dataset(f'chain {ch}', shape, dtype=data_type)
 
-    phi_dset.attrs['indices'] = phi_indices.astype(numpy.int32)
-    psi_dset.attrs['indices'] = psi_indices.astype(numpy.int32)
-    omega_dset.attrs['indices'] = omega_indices.astype(numpy.int32)
-    return numpy.hstack( time )
+    for angle, circ_sd in circ_sd_per_angle.items():
+        num_angles = numpy.shape(circ_sd)[-1]
+        if sum(lengths) != num_angles:
+            warnings.warn('Number of dihedral angles is inconsistent with the number of residues.')
+        for ch, chain_dih_sd in enumerate(split_chains(numpy.transpose(circ_sd), lengths)):
+            dset = dih_sd_group[f'chain {ch}']
+            data = dset[...]
+            if angle == 'phi':
+                data[angle][..., 1:] = numpy.transpose(chain_dih_sd)
+            else:
+                data[angle][..., :-1] = numpy.transpose(chain_dih_sd)
+            dset[...] = data
 
 
-def get_dihedral_sd(hdf_file, begin=0, end=1000, step=200):
+def get_dihedral_sd(hdf_file, begin=0, end=1000, step=200, accumulators=None):
     """
         hdf_file must contain dihedrals and sequence
 
         begin = Start frame in ns
         end = End frame in ns
         step = Number of frames per ns
+        accumulators = Accumulators filled while the dihedrals were
+                       computed. If not given, the dihedrals are read
+                       from hdf_file one chunk at a time.
     """
     start = int(begin * step)
-    end = int(end * step)
+    stop = int(end * step)
+    if accumulators is None:
+        accumulators = read_dihedral_accumulators(hdf_file, block=stop - start,
+                                                  start=start, stop=stop)
+        start, stop = 0, None
 
     dih_sd_group = hdf_file.require_group('dihedral_standard_deviation')
     dih_sd_group.attrs['unit'] = 'radians'
@@ -253,53 +752,175 @@ def get_dihedral_sd(hdf_file, begin=0, end=1000, step=200):
     dih_sd_group.attrs['end'] = f'{end} ns'
 
     lengths = [len(_) - 1  for _ in hdf_file.attrs['sequence'].split('/')]
-    data_type =  numpy.dtype([("phi", numpy.float),
-                              ("psi", numpy.float),
-                              ("omega", numpy.float)
-                            ])
+    circ_sd = {angle: accumulator.circstd(start, stop)
+               for angle, accumulator in accumulators.items()}
+    store_dihedral_sd(dih_sd_group, lengths, circ_sd)
 
-    for ch, length in enumerate(lengths):
-        dih_sd_group.create_dataset(f'chain {ch}', (length + 1,), dtype=data_type)
 
-    for angle in ['phi', 'psi', 'omega']:
-        _, num_angles = numpy.shape(hdf_file[f'/dihedrals/{angle}'])
-        if sum(lengths) != num_angles:
-            warnings.warn('Number of dihedral angles is inconsistent with the number of residues.')
-        circ_sd = scipy.stats.circstd(hdf_file[f'/dihedrals/{angle}'][start:end], axis=0, high=numpy.pi)
-        for ch, chain_dih_sd in enumerate(split_chains(circ_sd, lengths)):
-            dset = hdf_file[f'/dihedral_standard_deviation/chain {ch}']
-            if angle == 'phi':
-                dset[f'{angle}', 1:] = chain_dih_sd
-            else:
-                dset[f'{angle}', :-1] = chain_dih_sd
+def get_dihedral_sd_blocks(hdf_file, block_length=100, step=200, accumulators=None):
+    """ Circular standard deviation of dihedrals in consecutive blocks
+        of block_length ns, all evaluated from the same accumulators
+    """
+    block = int(block_length * step)
+    if block < 1:
+        raise ValueError(f'Blocks of {block_length} ns are shorter than a frame')
+    if accumulators is None:
+        accumulators = read_dihedral_accumulators(hdf_file, block=block)
+    num_frames = next(iter(accumulators.values())).num_frames
+    windows = [(start, min(start + block, num_frames))
+               for start in range(0, num_frames, block)]
+
+    dih_sd_group = hdf_file.require_group('dihedral_standard_deviation_blocks')
+    dih_sd_group.attrs['unit'] = 'radians'
+    dih_sd_group.attrs['begin'] = [start / step for start, _ in windows]
+    dih_sd_group.attrs['end'] = [stop / step for _, stop in windows]
+    dih_sd_group.attrs['time_unit'] = 'ns'
+
+    lengths = [len(_) - 1  for _ in hdf_file.attrs['sequence'].split('/')]
+    circ_sd = {angle: numpy.array([accumulator.circstd(start, stop)
+                                   for start, stop in windows])
+               for angle, accumulator in accumulators.items()}
+    store_dihedral_sd(dih_sd_group, lengths, circ_sd, num_windows=len(windows))
+
+
+def add_dihedrals(hdf_file, trajectory, structure, chunk=1000, atoms=None, jobs=1,
+                  sd_block=None):
+    """ Add the dihedrals and their standard deviation into the HDF file.
+        If only the trajectory changed since it was last collected, just
+        its new frames are computed and appended. If only sd_block
+        changed, the standard deviation in blocks is evaluated from the
+        stored dihedrals.
+    """
+    sources = {'trajectory': trajectory, 'structure': structure}
+    parameters = {'atoms': None if atoms is None else [int(_) for _ in atoms],
+                  'sd_block': sd_block}
+    group = hdf_file.get('dihedrals')
+    recorded = recorded_parameters(group)
+    same_atoms = recorded is not None and recorded.get('atoms') == parameters['atoms']
+    if same_atoms and not files_changed(group, sources):
+        if recorded.get('sd_block') == sd_block:
+            print(f'Skipping {trajectory} as it is already in the HDF5 file.')
+            return
+        print(f'Evaluating the dihedral standard deviation in blocks of {sd_block} ns')
+        store_dihedral_sd_blocks(hdf_file, sd_block)
+        record_sources(group, sources, parameters)
+        return
+    recorded_structure = json.loads(group.attrs['sources']).get('structure', {}) \
+        if group is not None and 'sources' in group.attrs else {}
+    same_structure = recorded_structure.get('sha1') == file_signature(structure)['sha1']
+    # Frames are only appended if the stored ones came from the beginning
+    # of this trajectory with the same atoms, otherwise the dihedrals are
+    # computed again
+    append = same_atoms and same_structure \
+        and extends_recorded(group, 'trajectory', trajectory) \
+        and 'time' in hdf_file and hdf_file['time'].maxshape[0] is None
+    # The accumulators only see the computed frames, so in append mode
+    # the standard deviation is evaluated from the stored dihedrals.
+    # Blocks dividing both 1 ns, with the 200 frames per ns assumed by
+    # get_dihedral_sd, and the windows of sd_block ns
+    block = math.gcd(200, int(sd_block * 200)) if sd_block else 200
+    accumulators = None if append else dihedral_accumulators(block=block)
+    time = get_dihedrals(hdf_file=hdf_file,
+                         trajectory=trajectory,
+                         structure=structure,
+                         chunk=chunk,
+                         atoms=atoms,
+                         jobs=jobs,
+                         accumulators=accumulators,
+                         append=append,
+    )
+    if append:
+        append_rows(hdf_file['time'], time)
+    else:
+        if 'time' in hdf_file:
+            del hdf_file['time']
+        hdf_file.create_dataset('time', data=time, maxshape=(None,), chunks=True)
+    hdf_file.attrs['time_unit'] = 'picosecond'
+    record_sources(hdf_file['dihedrals'], sources, parameters)
+    get_dihedral_sd(hdf_file=hdf_file, accumulators=accumulators)
+    store_dihedral_sd_blocks(hdf_file, sd_block, accumulators=accumulators)
+
+
+def store_dihedral_sd_blocks(hdf_file, sd_block, accumulators=None):
+    """ Evaluate the standard deviation in blocks of sd_block ns, or remove
+        the one stored before if sd_block is None
+    """
+    if sd_block:
+        get_dihedral_sd_blocks(hdf_file=hdf_file,
+                               block_length=sd_block,
+                               accumulators=accumulators,
+        )
+    elif 'dihedral_standard_deviation_blocks' in hdf_file:
+        del hdf_file['dihedral_standard_deviation_blocks']
 
 
-def add_dipoles(hdf_file, dipoles):
-    dipole_moment = numpy.loadtxt(dipoles, comments=('#', '@'), dtype=numpy.single)
+def read_dipoles(dipoles, cache=False):
+    """ Read the dipole moment .xvg file into a record array and the time """
+    dipole_moment = loadxvg(dipoles, cache=cache)
     data = numpy.core.records.fromarrays(dipole_moment[:, 1:].T, names='mu_x, mu_y, mu_z, mu')
-    dset = hdf_file.create_dataset('dipole_moment', data=data)
+    return data, dipole_moment[:, 0]
+
+
+def write_dipoles(hdf_file, data):
+    dipole_moment, time = data
+    dset = write_time_series(hdf_file, 'dipole_moment', dipole_moment, time=time)
     dset.attrs['unit'] = 'Debye'
 
 
-def add_sasa(hdf_file, sasa, unit='nanometer^2'):
-    group = hdf_file.require_group('sasa')
+def dipoles_task(dipoles, cache=False):
+    return CollectTask(path='dipole_moment',
+                       sources={'dipoles': dipoles},
+                       read=read_dipoles,
+                       read_kwargs=dict(dipoles=dipoles, cache=cache),
+                       write=write_dipoles,
+                       write_kwargs={},
+    )
+
+
+def add_dipoles(hdf_file, dipoles, cache=False):
+    collect_inputs(hdf_file, [dipoles_task(dipoles, cache=cache)])
+
+
+def read_sasa(sasa, cache=False):
+    """ Read the SASA .xvg files and split them into chains """
     if isinstance(sasa, list) and len(sasa) > 1:
         sasa_split_by_chains = []
         for xvg_file in sasa:
-            sasa_data = numpy.loadtxt(xvg_file, comments=('#', '@'), dtype=numpy.single)
+            sasa_data = loadxvg(xvg_file, cache=cache)
             sasa_split_by_chains.append(sasa_data)
     elif isinstance(sasa, list) and len(sasa) == 1:
-        sasa_data = numpy.loadtxt(sasa[0], comments=('#', '@'), dtype=numpy.single)
+        sasa_data = loadxvg(sasa[0], cache=cache)
         sasa_split_by_chains = split_increasing(sasa_data.T)
     else:
         raise TypeError
-    for ch, chain_sasa in enumerate(sasa_split_by_chains):
-        data = numpy.core.records.fromarrays(chain_sasa.T,
-            names='time, average, standard_deviation')
+    return [numpy.core.records.fromarrays(chain_sasa.T,
+                names='time, average, standard_deviation')
+            for chain_sasa in sasa_split_by_chains]
+
+
+def write_sasa(hdf_file, sasa_split_by_chains, unit='nanometer^2'):
+    if 'sasa' in hdf_file:
+        del hdf_file['sasa']
+    group = hdf_file.require_group('sasa')
+    for ch, data in enumerate(sasa_split_by_chains):
         group.create_dataset(f'chain {ch}', data=data)
     group.attrs['unit'] = unit
 
 
+def sasa_task(sasa, unit='nanometer^2', cache=False):
+    return CollectTask(path='sasa',
+                       sources={f'sasa {i}': xvg_file for i, xvg_file in enumerate(sasa)},
+                       read=read_sasa,
+                       read_kwargs=dict(sasa=sasa, cache=cache),
+                       write=write_sasa,
+                       write_kwargs=dict(unit=unit),
+    )
+
+
+def add_sasa(hdf_file, sasa, unit='nanometer^2', cache=False):
+    collect_inputs(hdf_file, [sasa_task(sasa, unit=unit, cache=cache)])
+
+
 def main(argv):
     if argv:
         args = docopt.docopt(__doc__, argv=argv)
@@ -312,55 +933,65 @@ def main(argv):
     with h5py.File(args['HDF_FILE'], 'a') as hdf_file:
         if args['--info']:
             add_info(hdf_file=hdf_file, info=args['--info'])
+        tasks = []
         if args['--all_atom_rmsd'] and args['--all_atom_rg']:
-            add_rmsd_rg(hdf_file=hdf_file,
-                        rmsd=args['--all_atom_rmsd'],
-                        rg=args['--all_atom_rg'],
-                        dataset='all_atom',
-                        comment=args['--comment'],
-            )
+            tasks.append(rmsd_rg_task(rmsd=args['--all_atom_rmsd'],
+                                      rg=args['--all_atom_rg'],
+                                      dataset='all_atom',
+                                      comment=args['--comment'],
+                                      cache=args['--cache'],
+            ))
         if args['--backbone_rmsd'] and args['--backbone_rg']:
-            add_rmsd_rg(hdf_file=hdf_file,
-                        rmsd=args['--backbone_rmsd'],
-                        rg=args['--backbone_rg'],
-                        dataset='backbone',
-                        comment=args['--comment'],
-            )
+            tasks.append(rmsd_rg_task(rmsd=args['--backbone_rmsd'],
+                                      rg=args['--backbone_rg'],
+                                      dataset='backbone',
+                                      comment=args['--comment'],
+                                      cache=args['--cache'],
+            ))
         if args['--c_alpha_rmsd'] and args['--c_alpha_rg']:
-            add_rmsd_rg(hdf_file=hdf_file,
-                        rmsd=args['--c_alpha_rmsd'],
-                        rg=args['--c_alpha_rg'],
-                        dataset='c-alpha',
-                        comment=args['--comment'],
-            )
+            tasks.append(rmsd_rg_task(rmsd=args['--c_alpha_rmsd'],
+                                      rg=args['--c_alpha_rg'],
+                                      dataset='c-alpha',
+                                      comment=args['--comment'],
+                                      cache=args['--cache'],
+            ))
         if args['--rmsf']:
-            add_rmsf(hdf_file=hdf_file, rmsf=args['--rmsf'].strip().split(),
-                        begin=args['<begin>'], end=args['<end>'])
+            tasks.append(rmsf_task(rmsf=args['--rmsf'].strip().split(),
+                                   begin=args['<begin>'], end=args['<end>'],
+                                   cache=args['--cache']))
 
         if args['--ss']:
-            add_dssp(hdf_file=hdf_file, dssp=args['--ss'])
+            tasks.append(dssp_task(dssp=args['--ss']))
 
         if args['--sasa']:
-            add_sasa(hdf_file=hdf_file, sasa=args['--sasa'].strip().split())
+            tasks.append(sasa_task(sasa=args['--sasa'].strip().split(),
+                                   cache=args['--cache']))
 
         if args['--dipoles']:
-            add_dipoles(hdf_file=hdf_file, dipoles=args['--dipoles'])
+            tasks.append(dipoles_task(dipoles=args['--dipoles'],
+                                      cache=args['--cache']))
 
         if args['--atoms']:
             atom_list = eval(args['--atoms'])
         else:
             atom_list = None
 
+        dihedrals = None
         if args['--trajectory'] and args['--structure'] and args['--chunk']:
-            time = get_dihedrals(hdf_file=hdf_file,
-                                 trajectory=args['--trajectory'],
-                                 structure=args['--structure'],
-                                 chunk=int(args['--chunk']),
-                                 atoms=atom_list,
+            dihedrals = functools.partial(add_dihedrals,
+                hdf_file=hdf_file,
+                trajectory=args['--trajectory'],
+                structure=args['--structure'],
+                chunk=int(args['--chunk']),
+                atoms=atom_list,
+                jobs=int(args['--jobs']),
+                sd_block=float(args['--sd_block']) if args['--sd_block'] else None,
             )
-            hdf_file.create_dataset('time', data=time)
-            hdf_file.attrs['time_unit'] = 'picosecond'
-            get_dihedral_sd(hdf_file=hdf_file)
+
+        # The dihedrals are computed and written by this process while
+        # the other files are read by the workers
+        collect_inputs(hdf_file, tasks, workers=int(args['--workers']),
+                       during=dihedrals)
 
 
 if __name__ == '__main__':
@@ -1,5 +1,7 @@
+import md_davis.electrostatics.batch
 import md_davis.electrostatics.cube3
 import md_davis.electrostatics.electrodynamics
 import md_davis.electrostatics.plot_potential
 import md_davis.electrostatics.surface_electrostatics
+import md_davis.electrostatics.surface_potential
 import md_davis.electrostatics.vert2pdb
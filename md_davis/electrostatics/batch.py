@@ -0,0 +1,213 @@
+""" Calculate the electrostatics for the frames of a trajectory. Each
+    frame is saved as a PDB file and MSMS, vert2pdb and Delphi are run on
+    it in its own temporary directory, with up to --jobs frames at a time.
+    The results of a frame are moved to OUTPUT_DIRECTORY only when all of
+    them are created, so an interrupted run can be resumed by running the
+    same command again, which skips the frames that are already done.
+    The temporary directory of a failed frame, .<name>_<frame>.<random>
+    in OUTPUT_DIRECTORY, is left for inspection and removed once the frame
+    is calculated in a later run, unless --keep is given.
+
+    The output files are named <name>_<frame>.pdb, <name>_<frame>.cub and,
+    with --surface_potential, <name>_<frame>.pot, where <name> is the name
+    of the trajectory file without the extension unless --name is given.
+
+Usage:  md_davis electrostatics batch [options] TRAJECTORY STRUCTURE OUTPUT_DIRECTORY
+
+Options:
+  -m, --msms PATH                   full path to MSMS executable [default: ~/]
+  -d, --delphi PATH                 full path to Delphi executable [default: ~/]
+  -r, --radius PATH                 path to radius file
+  -c, --charge PATH                 path to charge file
+  -g, --grid_size <odd_int>         Grid size to use for Delphi calculation
+                                    [default: 101]
+  --surface_potential               Whether to calculate the electrostatic
+                                    potential on the surface or not
+  --interpolate                     Interpolate the surface potential from
+                                    the potential map (.cub) instead of
+                                    calculating it with Delphi
+  --center                          Center the grid for Delphi at the origin
+  -n, --name <string>               Prefix for the output files
+  -b, --begin <int>                 First frame to include [default: 0]
+  -e, --end <int>                   Frame to stop before
+  -s, --stride <int>                Include every stride-th frame [default: 1]
+  -j, --jobs <int>                  Number of frames to process at the
+                                    same time [default: 1]
+  --overwrite                       Recalculate frames which already have
+                                    all the output files
+  --keep                            Keep the temporary directory of each
+                                    frame, including those of failed
+                                    attempts which are otherwise removed
+                                    once the frame is calculated
+"""
+
+import concurrent.futures
+import glob
+import os
+import shutil
+import sys
+import tempfile
+
+import docopt
+import mdtraj
+
+from .surface_electrostatics import surface_electrostatics
+from .vert2pdb import SurfaceMapper, read_atoms
+
+
+def frame_outputs(output_directory, name, on_surface=False):
+    """ Output files of a frame """
+    extensions = ['.pdb', '.cub'] + (['.pot'] if on_surface else [])
+    return [os.path.join(output_directory, name + ext) for ext in extensions]
+
+
+def frame_directories(output_directory, name):
+    """ Temporary directories of a frame left by earlier attempts """
+    pattern = os.path.join(glob.escape(output_directory), glob.escape(f'.{name}.') + '*')
+    return [_ for _ in glob.glob(pattern) if os.path.isdir(_)]
+
+
+def iter_frames(trajectory, structure, begin=0, end=None, stride=1, chunk=100):
+    """ Yield the index and the trajectory of each selected frame """
+    index = begin
+    for trj_chunk in mdtraj.iterload(trajectory, top=structure, chunk=chunk,
+                                     stride=stride, skip=begin):
+        for frame in trj_chunk:
+            if end is not None and index >= end:
+                return
+            yield index, frame
+            index += stride
+
+
+def process_frame(pdb_file, output_directory, keep=False, atoms=None, coordinates=None,
+                  **kwargs):
+    """ Run the electrostatics for one frame saved in its own directory and
+        move the results to output_directory. The keyword arguments are
+        passed on to surface_electrostatics. If the atoms of the topology
+        (from vert2pdb.read_atoms) and their coordinates in the frame are
+        given, the PDB file is not parsed again. The directory of a frame is
+        removed after its results are moved, unless keep is True, and is
+        left in place for inspection if the calculation fails.
+    """
+    frame_directory = os.path.dirname(pdb_file)
+    name = os.path.splitext(os.path.basename(pdb_file))[0]
+    mapper = SurfaceMapper(atoms, coordinates) if atoms is not None else None
+    # The surface PDB is not kept, so it is only written if Delphi needs it
+    cube_file, pot_file = surface_electrostatics(pdb_file=pdb_file,
+                                                 output_directory=frame_directory,
+                                                 working_directory=frame_directory,
+                                                 mapper=mapper,
+                                                 write_surface=False,
+                                                 **kwargs)
+    results = [pdb_file, cube_file] + ([pot_file] if pot_file else [])
+    missing = [_ for _ in results if not os.path.isfile(_)]
+    if missing:
+        raise RuntimeError('missing output ' + ', '.join(missing))
+    for result in results:
+        os.replace(result, os.path.join(output_directory, os.path.basename(result)))
+    if not keep:
+        shutil.rmtree(frame_directory)
+    return name
+
+
+def batch_electrostatics(trajectory, structure, output_directory, name=None,
+                         begin=0, end=None, stride=1, jobs=1,
+                         overwrite=False, keep=False, **kwargs):
+    """ Calculate the electrostatics for the frames of a trajectory in a
+        pool of jobs processes. Frames are read and written as PDB files
+        only while fewer than twice the number of jobs are waiting, so the
+        temporary files stay bounded. Returns the names of the frames
+        which were calculated and a dictionary of the failed ones with the
+        error.
+    """
+    output_directory = os.path.abspath(output_directory)
+    os.makedirs(output_directory, exist_ok=True)
+    if name is None:
+        name = os.path.splitext(os.path.basename(trajectory))[0]
+    # Each frame runs in its own directory, so relative paths are resolved
+    # here. Executables not found as a path are left to be searched in PATH.
+    for option in ['radius_file', 'charge_file', 'delphi_path']:
+        if kwargs.get(option) and os.path.exists(os.path.expanduser(kwargs[option])):
+            kwargs[option] = os.path.abspath(os.path.expanduser(kwargs[option]))
+    if kwargs.get('msms_path'):
+        kwargs['msms_path'] = os.path.join(os.path.abspath(os.path.expanduser(kwargs['msms_path'])), '')
+
+    done, failed = [], {}
+    pending = {}
+    # Atoms of the topology parsed from the first frame and shared by all
+    atoms = None
+
+    def collect(futures):
+        for future in futures:
+            frame_name = pending.pop(future)
+            try:
+                done.append(future.result())
+                print(f'Finished {frame_name}')
+                if not keep:
+                    for stale in frame_directories(output_directory, frame_name):
+                        shutil.rmtree(stale, ignore_errors=True)
+            except Exception as error:
+                failed[frame_name] = error
+                print(f'Failed {frame_name}: {error}')
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for index, frame in iter_frames(trajectory, structure, begin, end, stride):
+            frame_name = f'{name}_{index}'
+            outputs = frame_outputs(output_directory, frame_name, kwargs.get('on_surface'))
+            if not overwrite and all(os.path.isfile(_) for _ in outputs):
+                print(f'Skipping {frame_name}: already calculated')
+                continue
+            if len(pending) >= 2 * jobs:
+                finished, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                collect(finished)
+            frame_directory = tempfile.mkdtemp(prefix=f'.{frame_name}.', dir=output_directory)
+            pdb_file = os.path.join(frame_directory, frame_name + '.pdb')
+            frame.save_pdb(pdb_file)
+            coordinates = None
+            if kwargs.get('on_surface'):
+                if atoms is None:
+                    atoms = read_atoms(pdb_file)
+                coordinates = frame.xyz[0, atoms['index']] * 10  # Convert from nm to Å
+            future = executor.submit(process_frame, pdb_file, output_directory,
+                                     keep=keep, atoms=atoms, coordinates=coordinates,
+                                     **kwargs)
+            pending[future] = frame_name
+        collect(concurrent.futures.as_completed(list(pending)))
+    return done, failed
+
+
+def main(argv=None):
+    """ Calculate the electrostatics for the frames of a trajectory """
+    if argv:
+        args = docopt.docopt(__doc__, argv=argv)
+    else:
+        args = docopt.docopt(__doc__)
+
+    done, failed = batch_electrostatics(
+        trajectory=args['TRAJECTORY'],
+        structure=args['STRUCTURE'],
+        output_directory=args['OUTPUT_DIRECTORY'],
+        name=args['--name'],
+        begin=int(args['--begin']),
+        end=int(args['--end']) if args['--end'] else None,
+        stride=int(args['--stride']),
+        jobs=int(args['--jobs']),
+        overwrite=args['--overwrite'],
+        keep=args['--keep'],
+        delphi_path=args['--delphi'],
+        radius_file=args['--radius'],
+        charge_file=args['--charge'],
+        grid_size=args['--grid_size'],
+        msms_path=args['--msms'],
+        on_surface=args['--surface_potential'],
+        interpolate=args['--interpolate'],
+        center=args['--center'],
+    )
+    print(f'Calculated {len(done)} frames')
+    if failed:
+        sys.exit(f'Failed for {len(failed)} frames: ' + ', '.join(sorted(failed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,40 @@
 # http://erg.biophys.msu.ru/wordpress/archives/150
 # Author: Peter Mamonov
 
+import os
 import numpy as np
-from math import ceil, floor, sqrt
+from scipy.spatial import cKDTree
+
+
+def cache_filename(fname):
+    """ Name of the .npy file with the data of a cube file """
+    return fname + '.npy'
+
 
 class CUBE:
-    def __init__(self, fname):
-        f = open(fname, 'r')
+    def __init__(self, fname, cache=False, mmap_mode='r'):
+# Read the header line by line and the volumetric data in one pass.
+# With cache=True the data is also saved to a .npy file next to the cube
+# file, which is loaded (memory-mapped with mmap_mode) as long as it is
+# newer than the cube file.
+        with open(fname, 'r') as f:
+            self.read_header(f)
+            shape = (self.NX, self.NY, self.NZ)
+            sidecar = cache_filename(fname)
+            if cache and os.path.exists(sidecar) and \
+                    os.path.getmtime(sidecar) >= os.path.getmtime(fname):
+                self.data = np.load(sidecar, mmap_mode=mmap_mode)
+                if self.data.shape == shape:
+                    return
+# Volumetric data
+            values = np.fromstring(f.read(), dtype=np.float64, sep=' ')
+        if values.size != self.NX*self.NY*self.NZ:
+            raise NameError(f"FSCK! Expected {self.NX*self.NY*self.NZ} values in {fname}, found {values.size}")
+        self.data = values.reshape(shape)
+        if cache:
+            np.save(sidecar, self.data)
+
+    def read_header(self, f):
         for i in range(2): f.readline() # echo comment
         tkns = f.readline().split() # number of atoms included in the file followed by the position of the origin of the volumetric data
         self.natoms = int(tkns[0])
@@ -27,15 +55,7 @@ class CUBE:
         for i in range(self.natoms):
             tkns = f.readline().split()
             self.atoms.append([tkns[0], tkns[2], tkns[3], tkns[4]])
-# Volumetric data
-        self.data = np.zeros((self.NX,self.NY,self.NZ))
-        i=0
-        for s in f:
-            for v in s.split():
-                self.data[int(i/(self.NY*self.NZ)), int((i/self.NZ)%self.NY), i%self.NZ] = float(v)
-                i+=1
-        if i != self.NX*self.NY*self.NZ: raise NameError("FSCK!")
-     
+
     def dump(self, f):
 # output Gaussian cube into file descriptor "f". 
 # Usage pattern: f=open('filename.cube'); cube.dump(f); f.close()
@@ -46,32 +66,81 @@ class CUBE:
         print("%4d %.6f %.6f %.6f"% (self.NZ, self.Z[0], self.Z[1], self.Z[2]), file=f)
         for atom in self.atoms:
             print("%s %d %s %s %s" % (atom[0], 0, atom[1], atom[2], atom[3]), file=f)
+# Each row along z is written six values per line and ends with an empty
+# print, so the format of a whole slab along x is built once and all of its
+# values are formatted and written at once
+        row = ''.join("%.5e  " + ("\n" if iz % 6 == 5 else "") for iz in range(self.NZ)) + "\n"
+        slab = row * self.NY
         for ix in range(self.NX):
-            for iy in range(self.NY):
-                 for iz in range(self.NZ):
-                        print("%.5e " % self.data[ix,iy,iz], end=' ', file=f)
-                        if (iz % 6 == 5): print('', file=f)
-                 print("", file=f)
+            f.write(slab % tuple(np.asarray(self.data[ix], dtype=np.float64).ravel().tolist()))
  
+    def axes(self):
+# matrix with the axis vectors X, Y and Z as rows
+        return np.array([self.X, self.Y, self.Z], dtype=np.float64)
+
+    def grid_points(self, ix=slice(None), iy=slice(None), iz=slice(None)):
+# cartesian coordinates of the voxels (NX, NY, NZ, 3), or of the block of
+# voxels selected by the slices ix, iy and iz
+        index = np.mgrid[tuple(slice(*i.indices(n)) for i, n in
+                               zip((ix, iy, iz), (self.NX, self.NY, self.NZ)))]
+        return self.origin + np.moveaxis(index, 0, -1) @ self.axes()
+
     def mask_sphere(self, R, Cx,Cy,Cz):
 # produce spheric volume mask with radius R and center @ [Cx,Cy,Cz]
 # can be used for integration over spherical part of the volume
-        m=0*self.data
-        for ix in range( int(ceil((Cx-R)/self.X[0])), int(floor((Cx+R)/self.X[0])) ):
-            ryz=sqrt(R**2-(ix*self.X[0]-Cx)**2)
-            for iy in range( int(ceil((Cy-ryz)/self.Y[1])), int(floor((Cy+ryz)/self.Y[1])) ):
-                    rz=sqrt(ryz**2 - (iy*self.Y[1]-Cy)**2)
-                    for iz in range( int(ceil((Cz-rz)/self.Z[2])), int(floor((Cz+rz)/self.Z[2])) ):
-                            m[ix,iy,iz]=1
+# Only the voxels in the bounding box of the sphere (in index space, using
+# the origin and the axis vectors) are checked
+        m = np.zeros((self.NX, self.NY, self.NZ))
+        center = np.array([Cx, Cy, Cz], dtype=np.float64)
+        inverse = np.linalg.inv(self.axes())
+        fraction = (center - self.origin) @ inverse
+        extent = R * np.linalg.norm(inverse, axis=0)
+        low = np.maximum(np.ceil(fraction - extent).astype(int), 0)
+        high = np.minimum(np.floor(fraction + extent).astype(int) + 1, (self.NX, self.NY, self.NZ))
+        if np.any(high <= low):
+            return m
+        box = tuple(slice(l, h) for l, h in zip(low, high))
+        points = self.grid_points(*box)
+        m[box] = np.sum((points - center)**2, axis=-1) <= R**2
         return m
 
+    def voxel_volume(self):
+        return abs(np.linalg.det(self.axes()))
+
+    def voxel_tree(self):
+# KD-tree over the coordinates of all voxels, built once and reused. It
+# stores a copy of the coordinates, i.e. 24 bytes per voxel
+        if getattr(self, '_tree', None) is None:
+            self._tree = cKDTree(self.grid_points().reshape(-1, 3))
+        return self._tree
+
+    def integrate_spheres(self, centers, radii, data=None, mean=False):
+# integrate data (self.data by default, or any array of the same shape such
+# as a charge density) over many spheres at once, e.g. one per residue.
+# centers is (N, 3) and radii is a number or N numbers, in the units of
+# the grid. Returns the N integrals, or the mean value in each sphere if
+# mean is True (NaN for spheres containing no voxel)
+        values = np.asarray(self.data if data is None else data).ravel()
+        centers = np.atleast_2d(np.asarray(centers, dtype=np.float64))
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(centers),))
+        voxels = self.voxel_tree().query_ball_point(centers, radii)
+        lengths = np.array([len(_) for _ in voxels], dtype=np.int64)
+        indices = np.concatenate([np.asarray(_, dtype=np.int64) for _ in voxels]) \
+            if len(voxels) > 0 else np.zeros(0, dtype=np.int64)
+        spheres = np.repeat(np.arange(len(centers)), lengths)
+        sums = np.bincount(spheres, weights=values[indices], minlength=len(centers))
+        if mean:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return sums / lengths
+        return sums * self.voxel_volume()
+
 
 
 bohr2angs = lambda x: round(0.529177*x, 6)
 bohr2angstrom = np.vectorize(bohr2angs)
 
-def cube2angstrom(data):
-    """ Correct way of converting Bohr unit in CUBE format to Angstrom """
+def angstrom_axes(data):
+    """ Origin and axis vectors (as rows) of the grid in Angstrom """
     if data.X[0] > 0:
         X = bohr2angstrom(data.X)
         Y = bohr2angstrom(data.Y)
@@ -82,7 +151,12 @@ def cube2angstrom(data):
         Y = data.Y
         Z = data.Z
         origin = data.origin
+    return origin, np.array([X, Y, Z], dtype=np.float64)
+
 
+def cube2angstrom(data):
+    """ Correct way of converting Bohr unit in CUBE format to Angstrom """
+    origin, (X, Y, Z) = angstrom_axes(data)
     x_step = np.linalg.norm(X)
     y_step = np.linalg.norm(Y)
     z_step = np.linalg.norm(Z)
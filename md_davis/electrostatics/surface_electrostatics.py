@@ -18,13 +18,22 @@ Options:
                                     created by MSMS
   --surface_potential               Whether to calculate the electrostatic
                                     potential on the surface or not
+  --interpolate                     Interpolate the surface potential from
+                                    the potential map (.cub) instead of
+                                    calculating it with Delphi
   --center                          Center the grid for Delphi at the origin
+  --no_surface_pdb                  With --interpolate, pass the surface
+                                    vertices to the interpolation without
+                                    writing the surface PDB file
 """
 
 import os
 import docopt
 import subprocess
 
+from .surface_potential import surface_potential
+from .vert2pdb import vert2pdb
+
 
 def dir_path(path):
     if os.path.isdir(path):
@@ -59,8 +68,12 @@ def run_msms(pdb_file, output_directory=None, msms_path='~/', executable="msms.x
 
 
 def run_delphi(pdb_file, output_directory, output_filename,
-    delphi_path, radius_file, charge_file, grid_size=101, surface=None, center=False):
-    """ Run Delphi on protein surface created by MSMS program """
+    delphi_path, radius_file, charge_file, grid_size=101, surface=None, center=False,
+    working_directory=None):
+    """ Run Delphi on protein surface created by MSMS program. The parameter
+        file is written to and Delphi is run in the working_directory, which
+        is the current directory by default.
+    """
     # TODO: Rewrite using template string
     if not os.path.isdir(output_directory):
         os.mkdir(output_directory)
@@ -84,47 +97,84 @@ def run_delphi(pdb_file, output_directory, output_filename,
             f'out(frc, file="{output_directory}/{output_filename}.pot")',
             f'site(Atom, Potential, Reaction, Coulomb, Field)',
         ]
-    print('\n'.join(parameters) + '\n', file=open(f'{output_filename}_tmp.prm', 'w'))
-    subprocess.run([delphi_path, f'{output_filename}_tmp.prm'])
-    subprocess.run(['rm', f'{output_filename}_tmp.prm'])
-
-
-def main(argv=None):
-    """ Get the electrosatic potential on the surface points generated by MSMS """
-    if argv:
-        args = docopt.docopt(__doc__, argv=argv)
-    else:
-        args = docopt.docopt(__doc__)
-
-    this_script_path = os.path.dirname(os.path.realpath(__file__))
-
-    pdb_file = args['PDB_FILE']
+    parameter_file = os.path.join(working_directory or '.', f'{output_filename}_tmp.prm')
+    with open(parameter_file, 'w') as prm:
+        print('\n'.join(parameters) + '\n', file=prm)
+    subprocess.run([delphi_path, f'{output_filename}_tmp.prm'], cwd=working_directory)
+    os.remove(parameter_file)
+
+
+def surface_electrostatics(pdb_file, output_directory, delphi_path, radius_file, charge_file,
+                           grid_size=101, msms_path='~/', on_surface=False,
+                           vertices=None, surface=None, interpolate=False, center=False,
+                           working_directory=None, mapper=None, coordinates=None,
+                           write_surface=True):
+    """ Calculate the potential map of a structure with Delphi and, if
+        on_surface is True, the potential on its surface. The surface is
+        created with MSMS unless the vertices or surface PDB are given.
+        A vert2pdb.SurfaceMapper for the topology of the structure and its
+        coordinates can be given to avoid parsing pdb_file again. When the
+        surface potential is interpolated, the surface PDB file is only
+        needed if write_surface is True.
+        Returns the names of the .cub and .pot (or None) files.
+    """
     output_filename = os.path.splitext(os.path.basename(pdb_file))[0]
 
     surface_file = None
-    if args['--surface_potential']:
-        if args['--surface']:
-            surface_file = args['--surface']
+    if on_surface:
+        if surface:
+            surface_file = surface
         else:
-            if args['--vertices']:
-                vert_file = args['--vertices']
+            if vertices:
+                vert_file = vertices
             else:
                 vert_file = run_msms(pdb_file=pdb_file,
-                                    output_directory=args['OUTPUT_DIRECTORY'],
-                                    msms_path=args['--msms'])
-            surface_file = f"{args['OUTPUT_DIRECTORY']}/{output_filename}_surf.pdb"
-            # TODO: remove this subprocess run with a function
-            subprocess.run(['python', f'{this_script_path}/vert2pdb.py', vert_file, pdb_file, '-o', surface_file])
+                                    output_directory=output_directory,
+                                    msms_path=msms_path)
+            surface_file = f"{output_directory}/{output_filename}_surf.pdb"
+            # The surface is kept to interpolate on without reading it back
+            surface = vert2pdb(vert_file, pdb_file, output=surface_file,
+                               mapper=mapper, coordinates=coordinates,
+                               write=write_surface or not interpolate)
 
     run_delphi(pdb_file=pdb_file,
-               output_directory=args['OUTPUT_DIRECTORY'],
+               output_directory=output_directory,
                output_filename=output_filename,
-               surface=surface_file,
-               delphi_path=args['--delphi'],
-               radius_file=args['--radius'],
-               charge_file=args['--charge'],
-               grid_size=args['--grid_size'],
-               center=args['--center'],
+               surface=None if interpolate else surface_file,
+               delphi_path=delphi_path,
+               radius_file=radius_file,
+               charge_file=charge_file,
+               grid_size=grid_size,
+               center=center,
+               working_directory=working_directory,
+    )
+    cube_file = f"{output_directory}/{output_filename}.cub"
+    pot_file = f"{output_directory}/{output_filename}.pot" if on_surface else None
+    if on_surface and interpolate:
+        surface_potential(cube_file=cube_file, surface=surface, output=pot_file)
+    return cube_file, pot_file
+
+
+def main(argv=None):
+    """ Get the electrosatic potential on the surface points generated by MSMS """
+    if argv:
+        args = docopt.docopt(__doc__, argv=argv)
+    else:
+        args = docopt.docopt(__doc__)
+
+    surface_electrostatics(pdb_file=args['PDB_FILE'],
+                           output_directory=args['OUTPUT_DIRECTORY'],
+                           delphi_path=args['--delphi'],
+                           radius_file=args['--radius'],
+                           charge_file=args['--charge'],
+                           grid_size=args['--grid_size'],
+                           msms_path=args['--msms'],
+                           on_surface=args['--surface_potential'],
+                           vertices=args['--vertices'],
+                           surface=args['--surface'],
+                           interpolate=args['--interpolate'],
+                           center=args['--center'],
+                           write_surface=not args['--no_surface_pdb'],
     )
 
 
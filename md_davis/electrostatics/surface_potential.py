@@ -0,0 +1,140 @@
+""" Electrostatic potential on the surface of a protein interpolated from
+    the potential map (Gaussian cube file) written by Delphi.
+
+    The potential at each surface vertex (from the surface PDB created by
+    vert2pdb, or the surface returned by vert2pdb.vert2pdb without writing
+    it) is evaluated by trilinear interpolation on the grid, so the
+    site potentials are obtained without running Delphi with in(frc,...).
+    The output has the same layout as the .pot file written by Delphi.
+"""
+
+import os
+
+import numpy
+import pandas
+import scipy.ndimage
+
+from .cube3 import CUBE, angstrom_axes
+
+# Columns of the surface PDB written by vert2pdb
+SURFACE_COLUMNS = dict(
+    name=(12, 16),
+    resName=(17, 20),
+    chainID=(21, 22),
+    resSeq=(22, 26),
+    x=(30, 38),
+    y=(38, 46),
+    z=(46, 54),
+)
+
+
+def read_surface(surface_file):
+    """ Atom descriptors and coordinates of the surface vertices """
+    df = pandas.read_fwf(surface_file, header=None,
+                         colspecs=list(SURFACE_COLUMNS.values()),
+                         names=list(SURFACE_COLUMNS.keys()),
+                         dtype={'name': str, 'resName': str, 'chainID': str},
+                         keep_default_na=False)
+    return df
+
+
+def surface_table(surface):
+    """ Surface from vert2pdb.vert2pdb with the columns of read_surface """
+    vertices = numpy.asarray(surface['vertices'], dtype=numpy.float64)
+    return pandas.DataFrame(dict(
+        name=surface['atom_name'],
+        resName=surface['residue_name'],
+        chainID=surface['chain_id'],
+        resSeq=surface['residue_number'],
+        x=vertices[:, 0],
+        y=vertices[:, 1],
+        z=vertices[:, 2],
+    ))
+
+
+def fractional_index(cube, points):
+    """ Position of the points (in Angstrom) in units of the grid spacing
+        along each axis of the cube
+    """
+    origin, axes = angstrom_axes(cube)
+    return (numpy.asarray(points, dtype=numpy.float64) - origin) @ numpy.linalg.inv(axes)
+
+
+def interpolate(cube, points, field=False, step=0.5):
+    """ Potential at the points (N x 3, in Angstrom) by trilinear
+        interpolation of the cube. If field is True, the electric field
+        (minus the gradient of the potential, per Angstrom) is also
+        returned, from central differences of the interpolated potential
+        with a step of step voxels along each axis.
+    """
+    index = fractional_index(cube, points)
+    data = numpy.asarray(cube.data)
+
+    def potential_at(index):
+        return scipy.ndimage.map_coordinates(data, index.T, order=1, mode='nearest')
+
+    potential = potential_at(index)
+    if not field:
+        return potential
+    gradient = numpy.empty_like(index)
+    for axis in range(3):
+        shift = numpy.zeros(3)
+        shift[axis] = step
+        gradient[:, axis] = (potential_at(index + shift) - potential_at(index - shift)) / (2 * step)
+    # Gradient along the grid axes to cartesian coordinates
+    _, axes = angstrom_axes(cube)
+    return potential, -gradient @ numpy.linalg.inv(axes).T
+
+
+def write_potential(filename, surface, potential, field=None, title=''):
+    """ Write the site potentials in the layout of the .pot file from
+        Delphi, with 12 header lines and 2 footer lines. Delphi also
+        reports the reaction and coulombic potentials, which cannot be
+        separated from the map, so these are written as nan.
+    """
+    num = len(surface)
+    if field is None:
+        field = numpy.full((num, 3), numpy.nan)
+    values = numpy.column_stack([potential,
+                                 numpy.full(num, numpy.nan),
+                                 numpy.full(num, numpy.nan),
+                                 field])
+    header = [
+        ' DELPHI SITE POTENTIAL FILE',
+        ' potential interpolated from the map:',
+        f' {title}',
+        ' interpolation: trilinear',
+        f' number of sites: {num}',
+        ' reaction and coulombic potentials: not available',
+        ' units of potential: kT/e',
+        ' units of field: kT/(e Angstrom)',
+        ' field: minus gradient of the interpolated potential',
+        ' Data Output: Atom Potential Reaction Coulomb Field',
+        ' ----------------------------------------------------------------',
+        ' ATOM DESCRIPTOR    POTENTIAL  REACTION   COULOMB        Ex        Ey        Ez',
+    ]
+    row = '%-5s%3s%3s%9d' + '%10.4f' * values.shape[1]
+    lines = [row % (name, res, chain, seq, *value) for name, res, chain, seq, value in
+             zip(surface['name'], surface['resName'], surface['chainID'],
+                 surface['resSeq'], values.tolist())]
+    footer = [' ----------------------------------------------------------------',
+              f' total potential: {numpy.nansum(potential):.4f}']
+    with open(filename, 'w') as pot_file:
+        pot_file.write('\n'.join(header + lines + footer) + '\n')
+
+
+def surface_potential(cube_file, surface, output, cache=False):
+    """ Write the .pot file for the surface vertices using the potential
+        map of Delphi. The surface is either the surface PDB file or the
+        surface returned by vert2pdb.vert2pdb.
+    """
+    cube = CUBE(cube_file, cache=cache)
+    if isinstance(surface, str):
+        surface = read_surface(surface)
+    else:
+        surface = surface_table(surface)
+    points = surface[['x', 'y', 'z']].to_numpy(dtype=numpy.float64)
+    potential, field = interpolate(cube, points, field=True)
+    # The cube file may be in a temporary directory, e.g. in the batch
+    write_potential(output, surface, potential, field, title=os.path.basename(cube_file))
+    return potential
@@ -1,16 +1,119 @@
 #! /usr/bin/env python
-""" Convet .vert file obtained from MSMS (Michael F. Sanner) to .pdb 
-    file to be supplied to Delphi v8.0 as frc file 
-    
-    This script calculates the closest atom to each vertex and writes 
+""" Convet .vert file obtained from MSMS (Michael F. Sanner) to .pdb
+    file to be supplied to Delphi v8.0 as frc file
+
+    This script calculates the closest atom to each vertex and writes
     that in the PDB output.
 """
 
 import argparse
+import sys
 import numpy
-from sklearn.neighbors import KDTree
+from scipy.spatial import cKDTree
 from biopandas.pdb import PandasPdb
 
+# Fields of the nearest atom written for each vertex
+ATOM_FIELDS = ['atom_name', 'residue_name', 'chain_id', 'residue_number']
+
+# Record written for each vertex, with the atom name centered beforehand
+SURFACE_RECORD = 'ATOM        %s %-3s %-1s%4d    %8.3f%8.3f%8.3f\n'
+
+
+def read_vertices(vert_file):
+    """ Coordinates of the vertices in a .vert file from MSMS """
+    # Some Input files for hemoglobin simulation were raising UnicodeDecodeError
+    with open(vert_file, 'r', errors='replace') as vertex_file:
+        return numpy.loadtxt(vertex_file, usecols=(0, 1, 2), skiprows=3, ndmin=2)
+
+
+def read_atoms(pdb_file):
+    """ Fields and coordinates of the ATOM records in a PDB file. The
+        'index' of each atom is its position among all ATOM and HETATM
+        records, i.e. its index in a trajectory with the same topology.
+    """
+    pdb = PandasPdb().read_pdb(pdb_file)
+    df = pdb.df['ATOM']
+    records = numpy.sort(numpy.concatenate([pdb.df['ATOM']['line_idx'].to_numpy(),
+                                            pdb.df['HETATM']['line_idx'].to_numpy()]))
+    atoms = {field: df[field].to_numpy() for field in ATOM_FIELDS}
+    atoms['coordinates'] = df[['x_coord', 'y_coord', 'z_coord']].to_numpy(dtype=numpy.float64)
+    atoms['index'] = numpy.searchsorted(records, df['line_idx'].to_numpy())
+    return atoms
+
+
+class SurfaceMapper(object):
+    """ Assign each vertex to its closest atom. The atoms are parsed once
+        and the KD-tree is rebuilt by update() with the coordinates of
+        each new structure sharing the same topology.
+    """
+
+    def __init__(self, atoms, coordinates=None):
+        self.atoms = atoms
+        self.update(atoms['coordinates'] if coordinates is None else coordinates)
+
+    def update(self, coordinates):
+        """ Use new coordinates (in Å) for the atoms """
+        self.coordinates = numpy.asarray(coordinates, dtype=numpy.float64)
+        if self.coordinates.shape != (len(self.atoms['atom_name']), 3):
+            raise ValueError('Number of coordinates does not match the number of atoms')
+        self.tree = cKDTree(self.coordinates)
+        return self
+
+    def nearest_atoms(self, vertices):
+        """ Index of the closest atom to each vertex """
+        _, indices = self.tree.query(numpy.asarray(vertices, dtype=numpy.float64))
+        return indices
+
+    def surface(self, vertices):
+        """ Fields of the closest atom with the coordinates of each vertex """
+        indices = self.nearest_atoms(vertices)
+        surface = {field: self.atoms[field][indices] for field in ATOM_FIELDS}
+        surface['vertices'] = numpy.asarray(vertices, dtype=numpy.float64)
+        return surface
+
+
+def format_surface(surface):
+    """ Text of the PDB records for the vertices with the fields of their
+        closest atoms. The fields are gathered in columns and all records
+        are formatted with a single string formatting operation.
+    """
+    num = len(surface['vertices'])
+    if num == 0:
+        return ''
+    columns = numpy.empty((num, 7), dtype=object)
+    columns[:, 0] = numpy.char.center(surface['atom_name'].astype(str), 4)
+    columns[:, 1] = surface['residue_name']
+    columns[:, 2] = surface['chain_id']
+    columns[:, 3] = surface['residue_number']
+    columns[:, 4:] = surface['vertices']
+    return (SURFACE_RECORD * num) % tuple(columns.ravel().tolist())
+
+
+def write_surface(surface, output=None):
+    """ Write the vertices with the fields of their closest atoms as PDB """
+    (output or sys.stdout).write(format_surface(surface))
+
+
+def vert2pdb(vert_file, pdb_file, output=None, mapper=None, coordinates=None, write=True):
+    """ Convert the .vert file for the structure in pdb_file to a PDB file
+        for Delphi. A mapper created for the same topology can be reused,
+        with the coordinates of the structure, instead of parsing pdb_file.
+        Returns the surface (the fields of the closest atom and the
+        coordinates for each vertex), which is not written if write is
+        False, e.g. to pass it on to surface_potential directly.
+    """
+    if mapper is None:
+        mapper = SurfaceMapper(read_atoms(pdb_file))
+    if coordinates is not None:
+        mapper.update(coordinates)
+    surface = mapper.surface(read_vertices(vert_file))
+    if write and isinstance(output, str):
+        with open(output, 'w') as output_file:
+            write_surface(surface, output_file)
+    elif write:
+        write_surface(surface, output)
+    return surface
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -22,26 +125,7 @@ def main():
     parser.add_argument('-o', '--output',  metavar='surface.pdb', default=None, type=argparse.FileType('w'),
                         help='Output PDB file with the surface')
     args = parser.parse_args()
-
-    # Some Input files for hemoglobin simulation were raising UnicodeDecodeError
-    vertex_file = open(args.vert, 'r', errors='replace')
-    vertices = numpy.loadtxt(vertex_file, usecols=(0, 1, 2), skiprows=3)
-
-    pdb_file = PandasPdb().read_pdb(args.pdb)
-    df = pdb_file.df['ATOM']
-    coordinates = df[['x_coord', 'y_coord', 'z_coord']]
-
-    kdt = KDTree(coordinates, metric='euclidean')
-    atom_indices = kdt.query(vertices, return_distance=False, dualtree=True)
-
-    for vertex, index in zip(vertices, atom_indices):
-        residue = df.at[int(index), 'residue_name']
-        chain = df.at[int(index), 'chain_id']
-        name = df.at[int(index), 'atom_name']
-        resSeq = df.at[int(index), 'residue_number']
-        x, y, z = vertex
-        print(f'ATOM        {name:^4} {residue:3} {chain:1}{resSeq:4}    {x:8.3f}{y:8.3f}{z:8.3f}',
-            file=args.output)
+    vert2pdb(args.vert, args.pdb, output=args.output)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,3 +1,4 @@
 import md_davis.landscape.landscape
 import md_davis.landscape.landscape_animation
 import md_davis.landscape.rmsd_rg_landscape
+import md_davis.landscape.sparse_landscape
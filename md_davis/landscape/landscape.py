@@ -2,25 +2,41 @@ import math
 import numpy
 import h5py
 import itertools
+import multiprocessing
+import scipy.signal
+import scipy.sparse
 
-import plotly.offline as py
 import plotly.graph_objs as go
 import plotly.subplots
 
+from ..utils.plotly_html import write_html
+
 # Exact value after redifinition of SI units in May 2019
 R = 0.00831446261815324  # Energy in KJ / mol
 
+# Number of data points read at once from array-like inputs such as
+# HDF5 datasets
+CHUNK_SIZE = 1 << 20
+
 
 class Landscape(object):
 
     def __init__(self, name, xBins, yBins, label=None):
         self.name = name
         self.label = label if label else name
-        self.time_bins = [[[] for _ in range(len(yBins))] for _ in range(len(xBins))]
         self.zValues = numpy.zeros((len(xBins), len(yBins)))
         self.xBins = numpy.array(xBins)
         self.yBins = numpy.array(yBins)
         self.dims = {'x': None, 'y': None, 'z': None}
+        # Standard error of zValues from block bootstrap, if evaluated
+        self.zErrors = None
+        # Times grouped by bin in CSR layout: the times in bin (i, j) are
+        # bin_times[bin_offsets[k]:bin_offsets[k + 1]] with k = i * len(yBins) + j
+        self.bin_times = numpy.array([])
+        # Position of each point in the input in the same layout, which
+        # orders the points even if the times repeat, e.g. in concatenated runs
+        self.bin_frames = numpy.array([], dtype=numpy.int64)
+        self.bin_offsets = numpy.zeros(self.zValues.size + 1, dtype=numpy.int64)
 
     def __repr__(self):
         return 'Name:  ' + self.name + '\n' \
@@ -39,20 +55,69 @@ class Landscape(object):
                          + 'Y bins:\n' + self.yBins.__str__() +'\n\n'
 
     def __iter__(self):
-        for i, rows in enumerate(self.time_bins):
-            for j, time in enumerate(rows):
-                yield i, j, time
+        for i, j in itertools.product(range(len(self.xBins)), range(len(self.yBins))):
+            yield i, j, self.bin_time(i, j)
 
     def __len__(self):
         return len(self.xBins)
 
+    @property
+    def time_bins(self):
+        """ Nested lists of the times in each bin indexed as [x][y] """
+        per_bin = numpy.split(self.bin_times, self.bin_offsets[1:-1])
+        ny = len(self.yBins)
+        return [per_bin[i * ny:(i + 1) * ny] for i in range(len(self.xBins))]
+
+    def bin_time(self, i, j):
+        """ Times in the bin (i, j) """
+        k = i * len(self.yBins) + j
+        return self.bin_times[self.bin_offsets[k]:self.bin_offsets[k + 1]]
+
+    def bin_index(self, x_data, y_data):
+        """ Flattened bin index for each data point """
+        dx = numpy.digitize(x_data, self.xBins) - 1
+        dy = numpy.digitize(y_data, self.yBins) - 1
+        # 'wrap' keeps the old behaviour of indexing with dx - 1 = -1
+        return numpy.ravel_multi_index((dx, dy), self.zValues.shape, mode='wrap')
+
+    def set_time_index(self, bin_ids, times, frames=None):
+        """ Group the times and their frame indices, by default the
+            position in times, by their flattened bin index in CSR layout
+        """
+        if frames is None:
+            frames = numpy.arange(len(times))
+        order = numpy.argsort(bin_ids, kind='stable')
+        counts = numpy.bincount(bin_ids, minlength=self.zValues.size)
+        self.bin_times = numpy.asarray(times)[order]
+        self.bin_frames = numpy.asarray(frames, dtype=numpy.int64)[order]
+        self.bin_offsets = numpy.zeros(self.zValues.size + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=self.bin_offsets[1:])
+        return self
+
     def add_data(self, time, x_data, y_data):
-        """ Create a 2D counts and add times to the corresponding bins """
-        dx = numpy.digitize(x_data, self.xBins)
-        dy = numpy.digitize(y_data, self.yBins)
-        for t in range(len(time)):
-            self.zValues[dx[t] - 1][dy[t] - 1] += 1
-            self.time_bins[dx[t] - 1][dy[t] - 1].append(time[t])
+        """ Create a 2D counts and add times to the corresponding bins.
+            The inputs can be any sliceable array, e.g. HDF5 datasets,
+            which are read CHUNK_SIZE points at a time.
+        """
+        bin_ids, times = [numpy.zeros(0, dtype=numpy.intp)], [numpy.zeros(0)]
+        for start in range(0, len(time), CHUNK_SIZE):
+            stop = start + CHUNK_SIZE
+            bin_ids.append(self.bin_index(numpy.asarray(x_data[start:stop]),
+                                          numpy.asarray(y_data[start:stop])))
+            times.append(numpy.asarray(time[start:stop]))
+        bin_ids = numpy.concatenate(bin_ids)
+        time = numpy.concatenate(times)
+        counts = numpy.bincount(bin_ids, minlength=self.zValues.size)
+        self.zValues += counts.reshape(self.zValues.shape)
+        # New points follow the points already in the landscape
+        frames = len(self.bin_times) + numpy.arange(len(time))
+        if len(self.bin_times) > 0:
+            old_ids = numpy.repeat(numpy.arange(self.zValues.size),
+                                   numpy.diff(self.bin_offsets))
+            bin_ids = numpy.concatenate([old_ids, bin_ids])
+            time = numpy.concatenate([self.bin_times, time])
+            frames = numpy.concatenate([self.bin_frames, frames])
+        self.set_time_index(bin_ids, time, frames)
         return self
 
     def save(self, filename, name, xlabel='', ylabel=''):
@@ -64,6 +129,9 @@ class Landscape(object):
             dset.attrs['name'] = self.name
             dset.attrs['label'] = self.label
 
+            if self.zErrors is not None:
+                grp.create_dataset('zErrors', data=self.zErrors)
+
             if isinstance(self.dims, dict):
                 dims_grp = grp.create_group('dimensions')
                 for axis in ['x', 'y', 'z']:
@@ -80,16 +148,17 @@ class Landscape(object):
             dset.dims[1].attach_scale(grp['yBins'])
             dset.dims[1].label = ylabel
 
-            ref_dtype = h5py.special_dtype(ref=h5py.Reference)
-            t_dset = grp.create_dataset('time_bins', dset.shape, dtype=ref_dtype)
-            time_grp = grp.create_group('time_group')
-            for x, rows in enumerate(self.time_bins):
-                for y, time in enumerate(rows):
-                    if len(time) > 0:
-                        t = time_grp.create_dataset(f'({self.xBins[x]}, {self.yBins[y]})',
-                            data=numpy.array(time),
-                        )
-                        t_dset[x, y] = t.ref
+            # Times and frame indices sorted by bin with the offset of each
+            # bin in the flattened (x, y) grid, so the whole index is
+            # written in bulk
+            grp.create_dataset('bin_times', data=self.bin_times,
+                               chunks=True if len(self.bin_times) > 0 else None,
+                               compression='gzip', shuffle=True)
+            grp.create_dataset('bin_frames', data=self.bin_frames,
+                               chunks=True if len(self.bin_frames) > 0 else None,
+                               compression='gzip', shuffle=True)
+            grp.create_dataset('bin_offsets', data=self.bin_offsets,
+                               compression='gzip', shuffle=True)
         return
 
     @classmethod
@@ -104,42 +173,143 @@ class Landscape(object):
                 label = dset.attrs['label']
                 xBins = group['xBins']
                 yBins = group['yBins']
-                t_dset = group['time_bins']
                 landscape = cls(name=name, xBins=xBins, yBins=yBins, label=label)
                 landscape.zValues = dset[...]
-                for i, j in itertools.product(range(len(xBins)), range(len(yBins))):
-                    if t_dset[i,j]:
-                        landscape.time_bins[i][j] = hdf_file[t_dset[i,j]][...]
+                if 'zErrors' in group:
+                    landscape.zErrors = group['zErrors'][...]
+                if 'bin_offsets' in group:
+                    landscape.bin_times = group['bin_times'][...]
+                    landscape.bin_offsets = group['bin_offsets'][...]
+                    if 'bin_frames' in group:
+                        landscape.bin_frames = group['bin_frames'][...]
+                    else:
+                        landscape.bin_frames = cls.time_ranks(landscape.bin_times)
+                elif 'time_bins' in group:
+                    cls._read_time_references(landscape, hdf_file, group['time_bins'])
                 if group['dimensions']:
                     for axis in ['x', 'y', 'z']:
                         landscape.dims[axis] = group['dimensions'][axis][...]
                 landscapes.append(landscape)
             return landscapes
 
+    @staticmethod
+    def _read_time_references(landscape, hdf_file, t_dset):
+        """ Read times from the old layout with one dataset per bin """
+        references = t_dset[...]
+        bin_ids, times = [], []
+        for k, ref in enumerate(references.flat):
+            if ref:
+                time = hdf_file[ref][...]
+                bin_ids.append(numpy.full(len(time), k))
+                times.append(time)
+        if times:
+            times = numpy.concatenate(times)
+            landscape.set_time_index(numpy.concatenate(bin_ids), times,
+                                     Landscape.time_ranks(times))
+
+    @staticmethod
+    def time_ranks(times):
+        """ Frame indices from the order of the times, for files saved
+            without them
+        """
+        ranks = numpy.empty(len(times), dtype=numpy.int64)
+        ranks[numpy.argsort(times, kind='stable')] = numpy.arange(len(times))
+        return ranks
+
     @staticmethod
     def minmax(array):
-        min_value, max_value = numpy.Inf, -numpy.Inf
-        for item in array:
-            if item != numpy.NaN:
-                if item < min_value:
-                    min_value = item
-                if item > max_value:
-                    max_value = item
+        """ Minimum and maximum ignoring NaN, reading CHUNK_SIZE points at
+            a time from any sliceable array
+        """
+        min_value, max_value = numpy.inf, -numpy.inf
+        for start in range(0, len(array), CHUNK_SIZE):
+            chunk = numpy.asarray(array[start:start + CHUNK_SIZE], dtype=float)
+            min_value = numpy.fmin.reduce(chunk, axis=None, initial=min_value)
+            max_value = numpy.fmax.reduce(chunk, axis=None, initial=max_value)
         return (min_value, max_value)
 
-    def energy_landscape(self, temperature=298):
-        """ Perform Boltzmann inversion to get the energy landscape """
-        def boltzmann_inversion(p, p_max, T=298):
-            return numpy.NaN if p <= 0 else -R*T*numpy.log(p/p_max)
-        boltzmann_inversion = numpy.vectorize(boltzmann_inversion)
-
-        z_max = numpy.nanmax(self.zValues)
-        energies = boltzmann_inversion(self.zValues, z_max, temperature)
+    @staticmethod
+    def smooth_histogram(counts, sigma, truncate=4.0):
+        """ Convolve the histogram with a Gaussian kernel (a binned kernel
+            density estimate) using FFT. sigma is the width of the kernel
+            in number of bins along each axis.
+        """
+        sigma = numpy.broadcast_to(numpy.asarray(sigma, dtype=float), (counts.ndim,))
+        kernel = numpy.ones((1,) * counts.ndim)
+        for axis, width in enumerate(sigma):
+            radius = int(truncate * width + 0.5)
+            x = numpy.arange(-radius, radius + 1)
+            gauss = numpy.exp(-0.5 * (x / width) ** 2) if width > 0 else numpy.ones(1)
+            shape = [1] * counts.ndim
+            shape[axis] = len(gauss)
+            kernel = kernel * (gauss / gauss.sum()).reshape(shape)
+        smooth = scipy.signal.fftconvolve(counts, kernel, mode='same')
+        # A count adds at least kernel.min() to every bin within the kernel,
+        # so anything smaller is round-off noise of the FFT in empty regions
+        smooth[smooth < 0.5 * kernel.min()] = 0
+        return smooth
+
+    def energy_landscape(self, temperature=298, smoothing=None):
+        """ Perform Boltzmann inversion to get the energy landscape.
+            If smoothing is given, the histogram is first smoothed with a
+            Gaussian kernel of that width in bins.
+        """
+        counts = self.zValues
+        if smoothing:
+            counts = self.smooth_histogram(counts, smoothing)
+        z_max = numpy.nanmax(counts)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            energies = numpy.where(counts > 0, -R * temperature * numpy.log(counts / z_max), numpy.nan)
         self.zValues = energies - numpy.nanmax(energies)
         return self
 
+    def block_counts(self, block_length):
+        """ Sparse matrix of the histogram of each block of block_length
+            consecutive frames (blocks x bins)
+        """
+        bin_ids = numpy.repeat(numpy.arange(self.zValues.size),
+                               numpy.diff(self.bin_offsets))
+        # The frame index and not the time gives the block, so the blocks
+        # do not mix runs with the same times
+        blocks = self.bin_frames // block_length
+        num_blocks = blocks.max() + 1 if len(blocks) > 0 else 0
+        return scipy.sparse.csr_matrix(
+            (numpy.ones(len(blocks)), (blocks, bin_ids)),
+            shape=(num_blocks, self.zValues.size),
+        )
+
+    def bootstrap_errors(self, temperature=None, block_length=100, replicates=100,
+                         smoothing=None, jobs=1, seed=None):
+        """ Standard error of each bin from block bootstrap over time.
+            Blocks of block_length consecutive frames are resampled with
+            replacement, and the histogram (or the energy landscape if a
+            temperature is given) of each replicate is evaluated from the
+            histograms of the blocks. The replicates are split across jobs
+            processes. Energies are relative to the most populated bin of
+            each replicate.
+        """
+        if len(self.bin_times) < 1:
+            raise ValueError('No time index in the landscape to resample')
+        counts = self.block_counts(block_length)
+        seeds = numpy.random.SeedSequence(seed).spawn(jobs)
+        sizes = [len(_) for _ in numpy.array_split(numpy.arange(replicates), jobs)]
+        tasks = [(counts, size, child, self.zValues.shape, temperature, smoothing)
+                 for size, child in zip(sizes, seeds) if size > 0]
+        if jobs > 1:
+            with multiprocessing.Pool(jobs) as pool:
+                results = pool.starmap(bootstrap_moments, tasks)
+        else:
+            results = [bootstrap_moments(*_) for _ in tasks]
+        num, total, squares = [sum(_) for _ in zip(*results)]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            mean = total / num
+            variance = (squares - num * mean ** 2) / (num - 1)
+        self.zErrors = numpy.where(num > 1, numpy.sqrt(numpy.maximum(variance, 0)), numpy.nan)
+        return self
+
     @classmethod
-    def landscape(cls, name, time, x_data, y_data, shape=(100, 100), temperature=None, label=None):
+    def landscape(cls, name, time, x_data, y_data, shape=(100, 100), temperature=None, label=None,
+                  smoothing=None):
         if len(time) < 1 or len(x_data) < 1 or len(y_data) < 1:
             raise ValueError('Empty array provided in input')
         if len(time) != len(x_data) != len(y_data):
@@ -158,7 +328,7 @@ class Landscape(object):
         landscape = cls(name=name, xBins=x_bins, yBins=y_bins, label=label)
         landscape.add_data(time=time, x_data=x_data, y_data=y_data)
         if temperature:
-            landscape.energy_landscape(temperature=temperature)
+            landscape.energy_landscape(temperature=temperature, smoothing=smoothing)
         dimensions['z'] = (numpy.nanmin(landscape.zValues),
                            numpy.nanmax(landscape.zValues),
         )
@@ -166,7 +336,7 @@ class Landscape(object):
         return landscape
 
     @classmethod
-    def common_landscapes(cls, data, shape=(100, 100), temperature=None):
+    def common_landscapes(cls, data, shape=(100, 100), temperature=None, smoothing=None):
         """ Create enegry landscapes on axes with identical ranges """
         # Find the common range for all landscapes
         x_range, y_range = [], []
@@ -176,26 +346,38 @@ class Landscape(object):
                 y_range.append(cls.minmax(y_data))
             else:
                 raise RuntimeError
-        dimensions = dict(x=cls.minmax(numpy.array(x_range).flatten()),
-                          y=cls.minmax(numpy.array(y_range).flatten()),
-        )
-        # Create a common set of bins
-        x_bins = numpy.linspace(*dimensions['x'], shape[0])
-        y_bins = numpy.linspace(*dimensions['y'], shape[1])
+        x_bins, y_bins, dimensions = cls.common_bins(x_range, y_range, shape)
         # Create landscapes with common dimensions
         landscapes = []
-        z_range = []
         for name, (time, x_data, y_data, label) in data.items():
             print(f'Generating Landscape for {name}')
             landscape = cls(name=name, xBins=x_bins, yBins=y_bins, label=label)
             landscape.add_data(time=time, x_data=x_data, y_data=y_data)
             if temperature:
-                landscape.energy_landscape(temperature=temperature)
+                landscape.energy_landscape(temperature=temperature, smoothing=smoothing)
+            landscapes.append(landscape)
+        return cls.set_common_dimensions(landscapes, dimensions)
+
+    @classmethod
+    def common_bins(cls, x_range, y_range, shape=(100, 100)):
+        """ Create a common set of bins spanning the (min, max) ranges of
+            all landscapes
+        """
+        dimensions = dict(x=cls.minmax(numpy.array(x_range).flatten()),
+                          y=cls.minmax(numpy.array(y_range).flatten()),
+        )
+        x_bins = numpy.linspace(*dimensions['x'], shape[0])
+        y_bins = numpy.linspace(*dimensions['y'], shape[1])
+        return x_bins, y_bins, dimensions
+
+    @classmethod
+    def set_common_dimensions(cls, landscapes, dimensions):
+        """ Update the range for the 3 directions for each landscape """
+        z_range = []
+        for landscape in landscapes:
             z_range.append(numpy.nanmin(landscape.zValues))
             z_range.append(numpy.nanmax(landscape.zValues))
-            landscapes.append(landscape)
         dimensions['z'] = cls.minmax(numpy.array(z_range).flatten())
-        # Update the range for the 3 directions for each landscape
         for ls in landscapes:
             ls.dims = dimensions
         return landscapes
@@ -222,8 +404,11 @@ class Landscape(object):
                         filename='landscape.html',
                         xlabel='x', ylabel='y', zlabel='z',
                         width=None, height=None,
-                        othrographic=False, font_size=None, dtick=None):
-        """ Make 2 subplots """
+                        othrographic=False, font_size=None, dtick=None,
+                        include_plotlyjs='cdn'):
+        """ Make 2 subplots. include_plotlyjs is 'cdn', 'inline',
+            'directory' or the path to a local plotly.min.js
+        """
         subtitles = [ls.label for ls in landscapes]
         columns, rows = cls.get_layout(len(landscapes))
         fig = plotly.subplots.make_subplots(rows=rows,
@@ -303,14 +488,9 @@ class Landscape(object):
                 annotation.font = dict(family='Courier New, monospace',
                                        size=font_size)
 
-        div = py.plot(fig, include_plotlyjs=False, output_type='div')
-        # retrieve the div id for the figure
-        div_id = div.split('=')[1].split()[0].replace("'", "").replace('"', '')
-
         # Custom JS code to sync the view of the plots
         if othrographic:
             js = '''
-                <script>
                 var gd = document.getElementById('{div_id}');
                 var isUnderRelayout = false;
                 var oldCamera, newCamera;
@@ -341,10 +521,9 @@ class Landscape(object):
                 }}
                 isUnderRelayout = true;
                 }})
-                </script>'''.format(div_id=div_id)
+                '''.format(div_id='{plot_id}')
         else:
             js = '''
-                <script>
                 var gd = document.getElementById('{div_id}');
                 var isUnderRelayout = false;
                 var oldCamera, newCamera;
@@ -369,10 +548,31 @@ class Landscape(object):
                 }}
                 isUnderRelayout = true;
                 }})
-                </script>'''.format(div_id=div_id)
-        # merge everything
-        div = '<script src="https://cdn.plot.ly/plotly-latest.min.js"></script>' + div + js
-        print(div, file=open(filename, "w"))
+                '''.format(div_id='{plot_id}')
+        write_html(fig, filename, include_plotlyjs=include_plotlyjs, post_script=js)
+
+
+def bootstrap_moments(block_counts, replicates, seed, shape, temperature=None, smoothing=None):
+    """ Count, sum and sum of squares of each bin over block bootstrap
+        replicates, drawing the blocks with the given seed
+    """
+    rng = numpy.random.default_rng(seed)
+    num_blocks = block_counts.shape[0]
+    choices = rng.integers(num_blocks, size=(replicates, num_blocks))
+    # Number of times each block is drawn in each replicate
+    offsets = numpy.arange(replicates)[:, None] * num_blocks
+    weights = numpy.bincount((choices + offsets).ravel(),
+                             minlength=replicates * num_blocks).reshape(replicates, num_blocks)
+    values = numpy.asarray(block_counts.T @ weights.T).T.reshape(replicates, *shape)
+    if temperature:
+        if smoothing:
+            values = numpy.array([Landscape.smooth_histogram(_, smoothing) for _ in values])
+        z_max = values.max(axis=(1, 2), keepdims=True)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            values = numpy.where(values > 0, -R * temperature * numpy.log(values / z_max), numpy.nan)
+    valid = ~numpy.isnan(values)
+    values = numpy.where(valid, values, 0)
+    return valid.sum(axis=0), values.sum(axis=0), (values ** 2).sum(axis=0)
 
 
 def main():
@@ -12,10 +12,20 @@ Options:
                                 the plots [default: landscapes.html]
   -i, --index int               Index of the landscape to plot [default: 0]
   -t, --title <string>          Title for the figure [default: Energy Landscape]
+  --plotlyjs <source>           How to include plotly.js: cdn, inline,
+                                directory (a copy of plotly.min.js next to
+                                the output) or the path to a local
+                                plotly.min.js [default: cdn]
   -b, --begin int               Starting index for the data to include
                                 [default: 0]
   -e, --end int                 Last index for the data to include
   -s, --step int                Step size for the animation data [default: 1]
+  -m, --max_frames <int>        Maximum number of frames in the animation.
+                                Longer trajectories are decimated to
+                                evenly spaced time points, 0 for no limit
+                                [default: 10000]
+  --dwell                       Only show the first frame of each visit to
+                                a bin, skipping frames which stay in it
   --hide_surface                Hide the energy landscape surface
   --ortho                       Orthographic projection for 3D plots
   --width <int>                 Width of the plot
@@ -27,29 +37,27 @@ Options:
 """
 
 import docopt
-import plotly
 import numpy
 import plotly.graph_objects as go
 
 from .landscape import Landscape
+from ..utils.plotly_html import write_html
 
 
 def get_animation_data(landscape):
-    output = []
-    for i, row in enumerate(landscape.time_bins):
-        for j, time in enumerate(row):
-            for t in time:
-                output.append( (t, landscape.xBins[i], landscape.yBins[j], landscape.zValues[i, j]) )
-    return sorted(output)
-
-
-def frame_args(duration):
-    return {
-        "frame": {"duration": duration},
-        "mode": "immediate",
-        "fromcurrent": True,
-        "transition": {"duration": duration, "easing": "linear"},
-    }
+    """ Frame ordered array with the rows (t, x, y, z) for each point in
+        the landscape, where x, y and z are those of the bin of the point
+    """
+    bin_ids = numpy.repeat(numpy.arange(landscape.zValues.size),
+                           numpy.diff(landscape.bin_offsets))
+    order = numpy.argsort(landscape.bin_frames)
+    bin_ids = bin_ids[order]
+    i, j = numpy.divmod(bin_ids, len(landscape.yBins))
+    return numpy.column_stack([landscape.bin_times[order],
+                               landscape.xBins[i],
+                               landscape.yBins[j],
+                               landscape.zValues.ravel()[bin_ids],
+    ])
 
 
 def landscape_trajectory(landscape, data,
@@ -57,7 +65,8 @@ def landscape_trajectory(landscape, data,
                          xlabel='x', ylabel='y', zlabel='z',
                          width=None, height=None, hide_surface=False, marker_size=8,
                          title=None,
-                         othrographic=False, font_size=None, dtick=None):
+                         othrographic=False, font_size=None, dtick=None,
+                         include_plotlyjs='cdn'):
     """ Show the X and Y quiatity values from the trajectory on the landscape """
     x, y = numpy.meshgrid(landscape.xBins, landscape.yBins, indexing='ij')
     z = landscape.zValues
@@ -92,7 +101,86 @@ def landscape_trajectory(landscape, data,
         showlegend=True,
         legend_orientation="h",
     )
-    plotly.offline.plot(fig, filename=filename)
+    write_html(fig, filename, include_plotlyjs=include_plotlyjs, auto_open=True)
+
+
+def decimate(data, max_frames):
+    """ Evenly spaced rows of the time ordered data, at most max_frames """
+    if max_frames is None or len(data) <= max_frames:
+        return data
+    index = numpy.unique(numpy.linspace(0, len(data) - 1, max_frames).round().astype(int))
+    return data[index]
+
+
+def dwell_frames(data):
+    """ First row of each run of consecutive rows in the same bin """
+    if len(data) < 2:
+        return data
+    moved = (numpy.diff(data[:, 1]) != 0) | (numpy.diff(data[:, 2]) != 0)
+    return data[numpy.concatenate([[True], moved])]
+
+
+# Default maximum number of points on the path of an animation
+MAX_FRAMES = 10000
+
+# Every slider step is drawn with a tick, so the slider only has up to
+# this many steps, each pointing at an index along the path
+SLIDER_STEPS = 500
+
+
+def slider_indices(num_frames, max_steps=SLIDER_STEPS):
+    """ Evenly spaced indices along the path for the steps of the slider """
+    if num_frames <= max_steps:
+        return numpy.arange(num_frames)
+    return numpy.unique(numpy.linspace(0, num_frames - 1, max_steps).round().astype(int))
+
+
+# Plotly frames copy the data for every time step, so instead the position
+# marker (trace 1) is moved along the path (trace 0) by its index. The
+# slider is only redrawn when the position reaches the index of its next step
+ANIMATION_JS = '''
+var gd = document.getElementById('{plot_id}');
+function values(array) {
+    if (!array || !array.bdata) { return array; }
+    var types = {f4: Float32Array, f8: Float64Array, i4: Int32Array, u4: Uint32Array,
+                 i2: Int16Array, u2: Uint16Array, i1: Int8Array, u1: Uint8Array};
+    var bytes = Uint8Array.from(atob(array.bdata), c => c.charCodeAt(0));
+    return new types[array.dtype](bytes.buffer);
+}
+var path = gd.data[0];
+var x = values(path.x), y = values(path.y), z = values(path.z);
+var steps = gd.layout.sliders[0].steps.map(function(step) { return Number(step.value); });
+var current = 0, active = 0, timer = null;
+function show(index, moveSlider) {
+    current = index;
+    Plotly.restyle(gd, {x: [[x[index]]], y: [[y[index]]], z: [[z[index]]]}, [1]);
+    if (moveSlider) {
+        var k = index < steps[active] ? 0 : active;
+        while (k + 1 < steps.length && steps[k + 1] <= index) { k++; }
+        if (k !== active) {
+            active = k;
+            Plotly.relayout(gd, {'sliders[0].active': k});
+        }
+    }
+}
+function stop() { if (timer) { clearInterval(timer); timer = null; } }
+gd.on('plotly_sliderchange', function(event) {
+    if (event.interaction) {
+        stop();
+        active = event.step._index;
+        show(steps[active], false);
+    }
+});
+gd.on('plotly_buttonclicked', function(event) {
+    stop();
+    if (event.button.label === '&#9654;') {
+        timer = setInterval(function() {
+            show((current + 1) % x.length, true);
+            if (current === x.length - 1) { stop(); }
+        }, {duration});
+    }
+});
+'''
 
 
 def landscape_animation(landscape, data,
@@ -100,15 +188,38 @@ def landscape_animation(landscape, data,
                       xlabel='x', ylabel='y', zlabel='z',
                       title=None,
                       width=None, height=None,
-                      othrographic=False, font_size=None, dtick=None):
+                      othrographic=False, font_size=None, dtick=None,
+                      max_frames=MAX_FRAMES, dwell=False, duration=50,
+                      include_plotlyjs='cdn'):
+    """ Animate the trajectory on the landscape. The path is stored once
+        and the current position is updated by its index, so the size of
+        the HTML grows with the length of the path only. Use dwell and
+        max_frames to limit the number of frames for long trajectories.
+        The slider has at most SLIDER_STEPS evenly spaced steps.
+    """
+    if dwell:
+        data = dwell_frames(data)
+    num_frames = len(data)
+    data = decimate(data, max_frames)
+    if len(data) < num_frames:
+        print(f'Animating {len(data)} evenly spaced frames of {num_frames}. '
+              f'Increase --max_frames to include more.')
     x, y = numpy.meshgrid(landscape.xBins, landscape.yBins, indexing='ij')
     z = landscape.zValues
     time, x_val, y_val, z_val = data.T
     fig = go.Figure(
         data=[
-            go.Scatter3d(x=x_val,
-                         y=y_val,
-                         z=z_val,
+            go.Scatter3d(x=x_val.astype(numpy.float32),
+                         y=y_val.astype(numpy.float32),
+                         z=z_val.astype(numpy.float32),
+                         name='Trajectory',
+            ),
+            go.Scatter3d(x=x_val[:1],
+                         y=y_val[:1],
+                         z=z_val[:1],
+                         name='Position',
+                         mode="markers",
+                         marker=dict(color="red", size=10),
             ),
             go.Surface(x=x, y=y, z=z,
               colorscale='Cividis',
@@ -117,14 +228,6 @@ def landscape_animation(landscape, data,
               contours_z=dict(show=True, usecolormap=True, highlightcolor="limegreen", project_z=True)
             )
         ],
-        frames=[go.Frame(data=[go.Scatter3d(x=[x],
-                                      y=[y],
-                                      z=[z],
-                                      mode="markers",
-                                      marker=dict(color="red", size=10))],
-                        name=t,
-                        )
-        for t, x, y, z in data]
     )
     for axis in ['x', 'y', 'z']:
         if axis in landscape.dims:
@@ -140,16 +243,13 @@ def landscape_animation(landscape, data,
             "visible": True,
             "xanchor": "right"
         },
-        "transition": {"duration": 300, "easing": "cubic-in-out"},
+        "transition": {"duration": 0},
         "pad": {"b": 10, "t": 50},
         "len": 0.9,
         "x": 0.1,
         "y": 0,
-        "steps": [{"args": [[f.name], frame_args(50)],
-                   "label": str(k),
-                   "method": "animate",
-                  }
-        for k, f in enumerate(fig.frames)]
+        "steps": [{"args": [], "label": f'{time[index]:g}', "value": str(index),
+                   "method": "skip"} for index in slider_indices(len(time))]
     }]
     fig.update_layout(
          title=title if title else landscape.label,
@@ -157,14 +257,14 @@ def landscape_animation(landscape, data,
             {
                 "buttons": [
                     {
-                        "args": [None, frame_args(50)],
+                        "args": [],
                         "label": "&#9654;", # play symbol
-                        "method": "animate",
+                        "method": "skip",
                     },
                     {
-                        "args": [[None], frame_args(0)],
+                        "args": [],
                         "label": "&#9724;", # pause symbol
-                        "method": "animate",
+                        "method": "skip",
                     },
                 ],
                 "direction": "left",
@@ -176,7 +276,8 @@ def landscape_animation(landscape, data,
          ],
          sliders=sliders
     )
-    plotly.offline.plot(fig, filename=filename)
+    write_html(fig, filename, include_plotlyjs=include_plotlyjs, auto_open=True,
+               post_script=ANIMATION_JS.replace('{duration}', str(duration)))
 
 
 def main(argv=None):
@@ -192,7 +293,6 @@ def main(argv=None):
     landscapes = Landscape.open(args['HDF_FILE'])
     landscape = landscapes[int(args['--index'])]
     data = get_animation_data(landscape)[start:stop:step]
-    data = numpy.array(data)
 
     if args['--hide_labels']:
         xlabel, ylabel, zlabel = '', '', ''
@@ -216,6 +316,7 @@ def main(argv=None):
             font_size=int(args['--font_size']) if args['--font_size'] else None,
             dtick=eval(args['--dtick']) if args['--dtick'] else None,
             othrographic=args['--ortho'],
+            include_plotlyjs=args['--plotlyjs'],
         )
     else:
         landscape_animation(
@@ -231,6 +332,9 @@ def main(argv=None):
             font_size=int(args['--font_size']) if args['--font_size'] else None,
             dtick=eval(args['--dtick']) if args['--dtick'] else None,
             othrographic=args['--ortho'],
+            include_plotlyjs=args['--plotlyjs'],
+            max_frames=int(args['--max_frames']) or None,
+            dwell=args['--dwell'],
         )
 
 
@@ -15,9 +15,21 @@ Options:
                                 is provided the energy landscape is
                                 calculated using Boltzmann inversion,
                                 else only the histogram is evaluated
+  --smooth <float>              Width in bins of the Gaussian kernel used
+                                to smooth the histogram before Boltzmann
+                                inversion
+  --bootstrap <int>             Number of block bootstrap replicates used
+                                to estimate the standard error of each
+                                bin, which is saved with the landscape
+  --block <int>                 Number of consecutive frames in each block
+                                for --bootstrap [default: 100]
   -o, --output <filename.html>  Name for the output HTML file containing
                                 the plots [default: landscapes.html]
   -t, --title <string>          Title for the figure
+  --plotlyjs <source>           How to include plotly.js: cdn, inline,
+                                directory (a copy of plotly.min.js next to
+                                the output) or the path to a local
+                                plotly.min.js [default: cdn]
   -x, --x_bins int              Number of bins in the X direction
                                 [default: 100]
   -y, --y_bins int              Number of bins in the Y direction
@@ -36,8 +48,15 @@ Options:
   --hide_labels                 Hide the axes labels
   --select <string>             Select: all_atom, c-alpha or backbone
                                 [default: all_atom]
+  -j, --jobs <int>              Number of processes to read and bin the
+                                HDF_FILES in parallel, and to evaluate the
+                                --bootstrap replicates of each landscape
+                                [default: 1]
 """
 
+import contextlib
+import functools
+import multiprocessing
 import numpy
 import itertools
 import docopt
@@ -46,6 +65,88 @@ import h5py
 from .landscape import Landscape
 
 
+class HDF5Series(object):
+    """ A field of an HDF5 dataset between start and end, multiplied by
+        scale, which is only read when sliced. Landscape reads it in
+        chunks so the whole series is never loaded at once.
+    """
+
+    def __init__(self, dset, field, start=0, end=None, scale=1):
+        self.dset = dset
+        self.field = field
+        self.start, self.end, _ = slice(start, end).indices(len(dset))
+        self.scale = scale
+
+    def __len__(self):
+        return max(self.end - self.start, 0)
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(len(self))
+        data = self.dset[self.field, self.start + start:self.start + stop]
+        return data * self.scale if self.scale != 1 else data
+
+
+def open_series(hdf_file, select, start=0, end=None):
+    """ Name, label and lazy time, RMSD and Rg series (in Å) of a file """
+    name = hdf_file.attrs['short_label']
+    label = hdf_file.attrs['short_html']
+    group = hdf_file['/rmsd_rg/' + select]
+    time = HDF5Series(group, 'time', start, end)
+    rmsd = HDF5Series(group, 'rmsd', start, end, scale=10)  # Convert from nm to Å
+    rg = HDF5Series(group, 'rg', start, end, scale=10)    # Convert from nm to Å
+    if len(time) < 1 or len(rmsd) < 1 or len(rg) < 1:
+        raise ValueError('Invalid value for --begin or --end')
+    return name, label, time, rmsd, rg
+
+
+def file_ranges(filename, select, start=0, end=None):
+    """ Range of RMSD and Rg in a file, run in a worker process """
+    with h5py.File(filename, 'r') as hdf_file:
+        _, _, _, rmsd, rg = open_series(hdf_file, select, start, end)
+        return Landscape.minmax(rmsd), Landscape.minmax(rg)
+
+
+def file_landscape(filename, select, start=0, end=None, shape=(100, 100),
+                   temperature=None, smoothing=None, bins=None):
+    """ Landscape for a file, run in a worker process. If bins are
+        given as (x_bins, y_bins), they are used instead of bins spanning
+        the range of the data.
+    """
+    with h5py.File(filename, 'r') as hdf_file:
+        name, label, time, rmsd, rg = open_series(hdf_file, select, start, end)
+        print(f'Generating Landscape for {name}')
+        if bins is None:
+            return Landscape.landscape(name=name, time=time, x_data=rmsd, y_data=rg,
+                                       shape=shape, label=label,
+                                       temperature=temperature, smoothing=smoothing)
+        landscape = Landscape(name=name, xBins=bins[0], yBins=bins[1], label=label)
+        landscape.add_data(time=time, x_data=rmsd, y_data=rg)
+        if temperature:
+            landscape.energy_landscape(temperature=temperature, smoothing=smoothing)
+        return landscape
+
+
+def parallel_landscapes(filenames, select, start=0, end=None, shape=(100, 100),
+                        temperature=None, smoothing=None, common=False, jobs=1):
+    """ Read and bin each file in a process pool. For common landscapes
+        the ranges of all files are found in a first parallel pass and
+        the files are then binned on the shared grid.
+    """
+    make_landscape = functools.partial(file_landscape, select=select,
+        start=start, end=end, shape=shape,
+        temperature=temperature, smoothing=smoothing)
+    with multiprocessing.Pool(jobs) as pool:
+        if not common:
+            return pool.map(make_landscape, filenames)
+        ranges = pool.map(functools.partial(file_ranges, select=select,
+                                            start=start, end=end), filenames)
+        x_range, y_range = zip(*ranges)
+        x_bins, y_bins, dimensions = Landscape.common_bins(x_range, y_range, shape)
+        landscapes = pool.map(functools.partial(make_landscape, bins=(x_bins, y_bins)),
+                              filenames)
+    return Landscape.set_common_dimensions(landscapes, dimensions)
+
+
 def main(argv=None):
     if argv:
         args = docopt.docopt(__doc__, argv=argv)
@@ -60,6 +161,7 @@ def main(argv=None):
         temperature = float(args['--temperature'])
     else:
         temperature = None
+    smoothing = float(args['--smooth']) if args['--smooth'] else None
 
     num_files = len(args['HDF_FILES'])
     landscapes = []
@@ -79,19 +181,21 @@ def main(argv=None):
     else:
         if args['--dict']:
             landscapes = Landscape.common_landscapes(data=args['--dict'],
-                shape=shape, temperature=temperature)
+                shape=shape, temperature=temperature, smoothing=smoothing)
+        elif int(args['--jobs']) > 1:
+            landscapes = parallel_landscapes(args['HDF_FILES'],
+                select=args['--select'], start=start, end=end,
+                shape=shape, temperature=temperature, smoothing=smoothing,
+                common=args['--common'], jobs=int(args['--jobs']))
         else:
             input_data = {}
-            for filename in args['HDF_FILES']:
-                with h5py.File(filename, 'r') as hdf_file:
-                    name = hdf_file.attrs['short_label']
-                    label = hdf_file.attrs['short_html']
-                    group = hdf_file['/rmsd_rg/' + args['--select']]
-                    time = group['time'][start:end]
-                    rmsd = group['rmsd'][start:end] * 10  # Convert from nm to Å
-                    rg = group['rg'][start:end] * 10    # Convert from nm to Å
-                    if len(time) < 1 or len(rmsd) < 1 or len(rg) < 1:
-                        raise ValueError('Invalid value for --begin or --end')
+            with contextlib.ExitStack() as stack:
+                for filename in args['HDF_FILES']:
+                    hdf_file = stack.enter_context(h5py.File(filename, 'r'))
+                    # Read lazily as the ranges and histograms are
+                    # evaluated chunk by chunk from the open files
+                    name, label, time, rmsd, rg = open_series(hdf_file,
+                        args['--select'], start, end)
                     if args['--common']:
                         input_data[name] = [time, rmsd, rg, label]
                     else:
@@ -104,12 +208,23 @@ def main(argv=None):
                             shape=shape,
                             label=label,
                             temperature=temperature,
+                            smoothing=smoothing,
                         )
                         landscapes.append(landscape)
 
-        if args['--common'] and len(input_data) > 0:
-            landscapes = Landscape.common_landscapes(data=input_data,
-                shape=shape, temperature=temperature)
+                if args['--common'] and len(input_data) > 0:
+                    landscapes = Landscape.common_landscapes(data=input_data,
+                        shape=shape, temperature=temperature, smoothing=smoothing)
+
+        if args['--bootstrap']:
+            for ls in landscapes:
+                print(f'Estimating errors for {ls.name}')
+                ls.bootstrap_errors(temperature=temperature,
+                                    block_length=int(args['--block']),
+                                    replicates=int(args['--bootstrap']),
+                                    smoothing=smoothing,
+                                    jobs=int(args['--jobs']),
+                )
 
         if args['--save']:
             for ls in landscapes:
@@ -137,6 +252,7 @@ def main(argv=None):
         font_size=int(args['--font_size']) if args['--font_size'] else None,
         othrographic=args['--ortho'],
         dtick=eval(args['--dtick']) if args['--dtick'] else None,
+        include_plotlyjs=args['--plotlyjs'],
     )
 
 
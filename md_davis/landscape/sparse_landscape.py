@@ -0,0 +1,127 @@
+import numpy
+import h5py
+
+from .landscape import Landscape, R, CHUNK_SIZE
+
+
+class SparseLandscape(object):
+    """ Histogram over any number of collective variables which only
+        stores the occupied cells, as flattened cell indices with counts,
+        so that it never allocates the full N-dimensional grid.
+    """
+
+    def __init__(self, name, bins, label=None, axis_labels=None):
+        self.name = name
+        self.label = label if label else name
+        self.bins = [numpy.array(_) for _ in bins]
+        self.shape = tuple(len(_) for _ in self.bins)
+        self.axis_labels = list(axis_labels) if axis_labels else [''] * len(self.bins)
+        self.cells = numpy.zeros(0, dtype=numpy.int64)
+        self.counts = numpy.zeros(0, dtype=numpy.int64)
+
+    def __repr__(self):
+        return 'Name:  ' + self.name + '\n' \
+                         + 'Label: ' + self.label + '\n' \
+                         + 'Shape: ' + self.shape.__repr__() + '\n' \
+                         + 'Occupied cells: ' + str(len(self.cells)) + '\n'
+
+    def __len__(self):
+        return len(self.cells)
+
+    def cell_index(self, *data):
+        """ Flattened cell index for each data point """
+        indices = [numpy.clip(numpy.digitize(values, bins) - 1, 0, len(bins) - 1)
+                   for values, bins in zip(data, self.bins)]
+        return numpy.ravel_multi_index(indices, self.shape)
+
+    def add_data(self, *data):
+        """ Add the points given as one sliceable array per dimension,
+            reading CHUNK_SIZE points at a time
+        """
+        if len(data) != len(self.bins):
+            raise ValueError('Number of data arrays does not match the number of dimensions')
+        cells, counts = [self.cells], [self.counts]
+        for start in range(0, len(data[0]), CHUNK_SIZE):
+            stop = start + CHUNK_SIZE
+            chunk_cells = self.cell_index(*[numpy.asarray(_[start:stop]) for _ in data])
+            chunk_cells, chunk_counts = numpy.unique(chunk_cells, return_counts=True)
+            cells.append(chunk_cells)
+            counts.append(chunk_counts)
+        self.cells, inverse = numpy.unique(numpy.concatenate(cells), return_inverse=True)
+        self.counts = numpy.bincount(inverse.ravel(), weights=numpy.concatenate(counts),
+                                     minlength=len(self.cells)).astype(numpy.int64)
+        return self
+
+    def energies(self, temperature=298):
+        """ Boltzmann inversion of the occupied cells """
+        return -R * temperature * numpy.log(self.counts / self.counts.max())
+
+    def projection(self, x_axis=0, y_axis=1, temperature=None, smoothing=None):
+        """ Sum the counts over all other dimensions into a 2D Landscape
+            for the dimensions x_axis and y_axis
+        """
+        coordinates = numpy.unravel_index(self.cells, self.shape)
+        nx, ny = self.shape[x_axis], self.shape[y_axis]
+        flat = coordinates[x_axis] * ny + coordinates[y_axis]
+        landscape = Landscape(name=self.name,
+                              xBins=self.bins[x_axis],
+                              yBins=self.bins[y_axis],
+                              label=self.label,
+        )
+        landscape.zValues = numpy.bincount(flat, weights=self.counts,
+                                           minlength=nx * ny).reshape(nx, ny)
+        if temperature:
+            landscape.energy_landscape(temperature=temperature, smoothing=smoothing)
+        landscape.dims = dict(x=(self.bins[x_axis][0], self.bins[x_axis][-1]),
+                              y=(self.bins[y_axis][0], self.bins[y_axis][-1]),
+                              z=(numpy.nanmin(landscape.zValues),
+                                 numpy.nanmax(landscape.zValues)),
+        )
+        return landscape
+
+    @classmethod
+    def landscape(cls, name, data, shape=50, label=None, axis_labels=None, ranges=None):
+        """ Create a landscape with evenly spaced bins spanning the range
+            of each of the data arrays, or the given ranges
+        """
+        if len(data) < 1 or any(len(_) < 1 for _ in data):
+            raise ValueError('Empty array provided in input')
+        if len(set(len(_) for _ in data)) > 1:
+            raise ValueError('Unequal length of data arrays')
+        shape = numpy.broadcast_to(shape, (len(data),))
+        if ranges is None:
+            ranges = [Landscape.minmax(_) for _ in data]
+        bins = [numpy.linspace(*dimension, num) for dimension, num in zip(ranges, shape)]
+        landscape = cls(name=name, bins=bins, label=label, axis_labels=axis_labels)
+        return landscape.add_data(*data)
+
+    def save(self, filename, name):
+        print(f'Saving {name} ...')
+        with h5py.File(filename, 'a') as hdf_file:
+            grp = hdf_file.require_group('sparse_landscapes').create_group(name)
+            grp.attrs['name'] = self.name
+            grp.attrs['label'] = self.label
+            grp.attrs['shape'] = self.shape
+            grp.create_dataset('cells', data=self.cells, compression='gzip', shuffle=True)
+            grp.create_dataset('counts', data=self.counts, compression='gzip', shuffle=True)
+            bins_grp = grp.create_group('bins')
+            for axis, (bins, label) in enumerate(zip(self.bins, self.axis_labels)):
+                dset = bins_grp.create_dataset(str(axis), data=bins)
+                dset.attrs['label'] = label
+
+    @classmethod
+    def open(cls, filename):
+        landscapes = []
+        with h5py.File(filename, 'r') as hdf_file:
+            for key, group in hdf_file['/sparse_landscapes/'].items():
+                print(f'Loading landscape for {key} ...')
+                axes = sorted(group['bins'], key=int)
+                landscape = cls(name=group.attrs['name'],
+                                bins=[group['bins'][_][...] for _ in axes],
+                                label=group.attrs['label'],
+                                axis_labels=[group['bins'][_].attrs['label'] for _ in axes],
+                )
+                landscape.cells = group['cells'][...]
+                landscape.counts = group['counts'][...]
+                landscapes.append(landscape)
+        return landscapes
@@ -14,6 +14,10 @@ Options:
   --3d                      Make 3D plot
   -b, --both                Make both a 3D plot and a 2D polar plot
   -c, --center              Show the center in the 3D plot
+  --plotlyjs <source>       How to include plotly.js: cdn, inline,
+                            directory (a copy of plotly.min.js next to
+                            the output) or the path to a local
+                            plotly.min.js [default: cdn]
 """
 
 import numpy
@@ -22,12 +26,12 @@ import os
 import docopt
 import h5py
 import plotly.graph_objs as go
-from plotly.offline import plot
 import plotly
 from plotly.colors import DEFAULT_PLOTLY_COLORS
 
 # Local imports
 from ..utils import polar
+from ..utils.plotly_html import write_html
 
 
 def sample(array, size=None):
@@ -40,11 +44,11 @@ def sample(array, size=None):
     return array[::step]
 
 
-def plot_dipoles(dictionary, filename=None, title=None):
+def plot_dipoles(dictionary, filename=None, title=None, include_plotlyjs='cdn'):
     fig = plotly.subplots.make_subplots(rows=3, cols=1, vertical_spacing=0.03, shared_xaxes=True)
     for i, (label, value) in enumerate(dictionary.items()):
         magnitude, azimuth, inclination = value
-        x_data = list(range(len(magnitude)))
+        x_data = numpy.arange(len(magnitude))
 
         chosen_color = DEFAULT_PLOTLY_COLORS[i % len(DEFAULT_PLOTLY_COLORS)]
         trace = go.Scatter(
@@ -96,12 +100,13 @@ def plot_dipoles(dictionary, filename=None, title=None):
     fig['layout']['yaxis3'].update(title='Inclination (degrees)', range=[0, 181],
                                    tick0=0, dtick=30)
     if filename:
-        plot(fig, filename=filename)
+        write_html(fig, filename, include_plotlyjs=include_plotlyjs, auto_open=True)
     else:
         fig.show()
 
 
-def plot_dipoles3d(dictionary, filename=None, title=None, centroid=False):
+def plot_dipoles3d(dictionary, filename=None, title=None, centroid=False,
+                   include_plotlyjs='cdn'):
     data = []
     for i, (label, value) in enumerate(dictionary.items()):
         x_data, y_data, z_data = value
@@ -154,7 +159,7 @@ def plot_dipoles3d(dictionary, filename=None, title=None, centroid=False):
     )
 
     if filename:
-        plot(fig, filename=filename)
+        write_html(fig, filename, include_plotlyjs=include_plotlyjs, auto_open=True)
     else:
         fig.show()
 
@@ -187,12 +192,15 @@ def main(argv):
             dipoles_dict[ hdf_file.attrs['short_html'] ] = dipoles
 
     if args['--3d']:
-        plot_dipoles3d(dipoles_dict, filename=output, title=title, centroid=args['--center'])
+        plot_dipoles3d(dipoles_dict, filename=output, title=title, centroid=args['--center'],
+                       include_plotlyjs=args['--plotlyjs'])
     else:
-        plot_dipoles(polar_dipoles, filename=output, title=title)
+        plot_dipoles(polar_dipoles, filename=output, title=title,
+                     include_plotlyjs=args['--plotlyjs'])
 
     if args['--both']:
-        plot_dipoles3d(dipoles_dict, filename='3D_' + output, title=title, centroid=args['--center'])
+        plot_dipoles3d(dipoles_dict, filename='3D_' + output, title=title, centroid=args['--center'],
+                       include_plotlyjs=args['--plotlyjs'])
 
 
 if __name__ == '__main__':
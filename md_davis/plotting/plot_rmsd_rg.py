@@ -1,6 +1,5 @@
 import collections
 from plotly import tools
-from plotly.offline import plot
 import numpy
 import plotly.graph_objs as go
 import h5py
@@ -8,6 +7,8 @@ import os
 import argparse
 import colorsys
 
+from ..utils.plotly_html import write_html
+
 
 def get_colors(num_colors, lightness=0.5, saturation=0.5, opacity=1.0):
     for hue in numpy.linspace(0, 1, num_colors, endpoint=False):
@@ -65,7 +66,7 @@ def continuous_errorbar(x, y, err, name, hover_text=None,
     return [lower_bound, trace, upper_bound]
 
 
-def main():
+def main(argv=None):
     fig = tools.make_subplots(rows=1, cols=1)
     fig['layout'].update({f'yaxis2': dict(anchor='x', overlaying='y',
         side='right', showgrid=False, title='R<sub>G</sub>') })
@@ -75,8 +76,12 @@ def main():
     parser.add_argument('files', nargs='+', help='Input HDF5 data files')
     parser.add_argument('-t', '--title', default='', help='Title')
     parser.add_argument('-o', '--output', default='output.html', help='Output file name')
-    parser.add_argument('-w', '--window', default=200, help='Window size for averaging')
-    args = parser.parse_args()
+    parser.add_argument('-w', '--window', default=200, type=int, help='Window size for averaging')
+    parser.add_argument('--plotlyjs', default='cdn',
+        help='How to include plotly.js: cdn, inline, directory (a copy of plotly.min.js '
+             'next to the output) or the path to a local plotly.min.js')
+    # argv from md_davis starts with the command: plot rmsd_rg
+    args = parser.parse_args(argv[2:] if argv else None)
 
     rmsd_traces, rg_traces = [], []
 
@@ -119,7 +124,7 @@ def main():
     fig['layout']['xaxis1'].update(title='Time (in ns)')
     fig['layout']['yaxis1'].update(title='RMSD (in Å)')
     fig['layout'].update(title=args.title)
-    plot(fig, filename=args.output)
+    write_html(fig, args.output, include_plotlyjs=args.plotlyjs, auto_open=True)
 
 
 if __name__ == "__main__":
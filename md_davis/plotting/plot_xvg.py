@@ -17,57 +17,35 @@ Options:
   -c, --columns <columns>       Columns to use (start from second column = 1)')
   -p, --plotly HTML_FILENAME    Use plotly for plotting.
                                 By default plots are created using matplotlib.
+  --cache                       Cache the parsed data next to XVG_FILE and
+                                reuse it if the file is unchanged
 
 """
 
 import docopt
 import numpy
-import re
+
+from ..utils import xvg
 
 
 def parse_header(in_file):
     """ Parse header of .xvg files """
     with open(in_file, "r") as inp_file:
-        header = []
-        for current_line in inp_file:
-            if current_line.startswith("@"):
-                header.append(current_line[1:])
-    output = {}
-    title = re.compile(r'\s+title\s+\"(.+)\"')
-    xlabel = re.compile(r'\s+xaxis  label\s+\"(.+)\"')
-    ylabel = re.compile(r'\s+yaxis  label\s+\"(.+)\"')
-    legend = re.compile(r'\s+s(\d+)\s+legend\s+\"(.+)\"')
-    legend_dict = {}
-    for header_line in header:
-        title_match = title.search(header_line)
-        xlabel_match = xlabel.search(header_line)
-        ylabel_match = ylabel.search(header_line)
-        legend_match = legend.search(header_line)
-        if title_match:
-            output['title'] = title_match.group(1)
-        if xlabel_match:
-            output['xlabel'] = xlabel_match.group(1)
-        if ylabel_match:
-            output['ylabel'] = ylabel_match.group(1)
-        if legend_match:
-            label = legend_match.group(2).replace('\\s', ' ').replace('\\N', '')
-            legend_dict[int(legend_match.group(1))] = label
-    if legend_dict:
-        output['legend'] = legend_dict
-    return output
-
-
-def parse_xvg(input_file, columns=None, output_file=None):
+        header = [line[1:] for line in inp_file if line.startswith("@")]
+    return xvg.parse_header(header)
+
+
+def parse_xvg(input_file, columns=None, output_file=None, cache=False):
     """ Parse the contents of .xvg files generated by Gromacs. """
-    if columns:
-        data = numpy.loadtxt(input_file, comments=('#', '@', '&'), unpack=True,
-                             usecols=[0] + columns)
-    else:
-        data = numpy.loadtxt(input_file, comments=('#', '@', '&'), unpack=True)
+    data, header = xvg.read_xvg(input_file, dtype=numpy.float64,
+                                usecols=[0] + columns if columns else None,
+                                cache=cache)
+    # Same shape as numpy.loadtxt with unpack=True
+    data = numpy.squeeze(data.T)
+    if not columns:
         columns = range(1, len(data))
     if output_file:
         numpy.save(output_file, data)
-    header = parse_header(input_file)
     if 'legend' in header:
         legend_dict = header['legend']
         labels = []
@@ -167,6 +145,7 @@ def main(argv=None):
     parsed_data = parse_xvg(input_file=args['XVG_FILE'],
                             columns=columns,
                             output_file=args['--output'],
+                            cache=args['--cache'],
     )
     if args['--plotly']:
         plotly_xvg(args['--plotly'], *parsed_data)
@@ -2,7 +2,9 @@ import md_davis.utils.contacts
 import md_davis.utils.hbonds
 import md_davis.utils.my_matplotlib
 import md_davis.utils.phylogenetic_tree
+import md_davis.utils.plotly_html
 import md_davis.utils.polar
 import md_davis.utils.rmsf_analysis
 import md_davis.utils.schlitters_entropy
 import md_davis.utils.secStr_counts
+import md_davis.utils.xvg
@@ -0,0 +1,185 @@
+"""
+    Write Plotly figures as compact HTML files.
+
+    Numerical arrays in the traces are written as base64 encoded typed
+    arrays instead of JSON lists of numbers when the included plotly.js
+    can decode them (version 2.28 and above), large 2D scatter plots are
+    drawn with WebGL (scattergl), and plotly.js can be referenced from the
+    CDN, embedded in the file or loaded from a local copy, so that the
+    plots also open offline.
+"""
+
+import base64
+import os
+import re
+
+import numpy
+import plotly.graph_objects as go
+import plotly.io
+import plotly.offline
+
+# Typed arrays understood by plotly.js
+TYPED_ARRAYS = ('f8', 'f4', 'i4', 'u4', 'i2', 'u2', 'i1', 'u1')
+
+# Arrays shorter than this are left as lists, which also keeps fixed
+# length attributes such as ranges and domains untouched
+MIN_ENCODED_SIZE = 16
+
+# Scatter traces with at least this many points are drawn with WebGL
+WEBGL_THRESHOLD = 1000
+
+def binary_supported(version=None):
+    """ Typed array specs are decoded by plotly.js 2.28 and above. The
+        version defaults to that of the plotly.js bundled with plotly.py.
+    """
+    if version is None:
+        version = plotly.offline.get_plotlyjs_version()
+    version = version.split('.')
+    return tuple(int(_) for _ in version[:2]) >= (2, 28)
+
+
+def local_plotlyjs_version(path):
+    """ Version of a local plotly.js file from its header comment, or
+        None if it can not be read
+    """
+    try:
+        with open(path, errors='replace') as js_file:
+            header = js_file.read(1024)
+    except OSError:
+        return None
+    match = re.search(r'plotly\.js v(\d+\.\d+)', header)
+    return match.group(1) if match else None
+
+
+def encode_array(array):
+    """ Typed array spec of plotly.js for a numerical array, or None if
+        it cannot be encoded
+    """
+    array = numpy.asarray(array)
+    if array.dtype.kind not in 'biuf' or array.size < MIN_ENCODED_SIZE:
+        return None
+    if array.dtype.kind == 'b':
+        array = array.astype(numpy.uint8)
+    elif array.dtype.itemsize > 4 and array.dtype.kind in 'iu':
+        # plotly.js has no 64 bit integer arrays
+        if array.min() >= numpy.iinfo(numpy.int32).min and array.max() <= numpy.iinfo(numpy.int32).max:
+            array = array.astype(numpy.int32)
+        else:
+            array = array.astype(numpy.float64)
+    elif array.dtype.kind == 'f' and array.dtype.str[1:] not in TYPED_ARRAYS:
+        array = array.astype(numpy.float64)
+    array = numpy.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+    spec = dict(dtype=array.dtype.str[1:],
+                bdata=base64.b64encode(array.tobytes()).decode('ascii'))
+    if array.ndim > 1:
+        spec['shape'] = ', '.join(str(_) for _ in array.shape)
+    return spec
+
+
+def encode_arrays(value):
+    """ Replace the numerical arrays in the properties of a trace with
+        typed array specs
+    """
+    if isinstance(value, dict):
+        return {key: encode_arrays(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, numpy.ndarray)):
+        try:
+            spec = encode_array(value)
+        except (ValueError, TypeError):
+            # Ragged or mixed lists
+            spec = None
+        if spec is not None:
+            return spec
+        if isinstance(value, numpy.ndarray):
+            return value
+        return [encode_arrays(item) for item in value]
+    return value
+
+
+def decode_arrays(value):
+    """ Replace typed array specs and numpy arrays in the properties of a
+        trace with lists, for plotly.js versions without typed arrays
+    """
+    if isinstance(value, dict):
+        if 'bdata' in value and 'dtype' in value:
+            array = numpy.frombuffer(base64.b64decode(value['bdata']),
+                                     dtype=numpy.dtype(value['dtype']).newbyteorder('<'))
+            if 'shape' in value:
+                shape = value['shape']
+                if isinstance(shape, str):
+                    shape = [int(_) for _ in shape.split(',')]
+                array = array.reshape(shape)
+            return array.tolist()
+        return {key: decode_arrays(item) for key, item in value.items()}
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [decode_arrays(item) for item in value]
+    return value
+
+
+def num_points(trace):
+    """ Number of points in a trace along x or y """
+    return max([len(_) for _ in (trace.x, trace.y) if _ is not None], default=0)
+
+
+def figure_dict(fig, webgl=True, binary=True):
+    """ Dictionary of the figure with WebGL scatter traces and encoded
+        arrays, which can be passed on to plotly.io without validation
+    """
+    fig = go.Figure(fig)
+    output = fig.to_plotly_json()
+    for trace, trace_dict in zip(fig.data, output['data']):
+        if webgl and trace.type == 'scatter' and num_points(trace) >= WEBGL_THRESHOLD:
+            trace_dict['type'] = 'scattergl'
+    # Depending on the version, plotly.py may already encode the arrays
+    if binary:
+        output['data'] = [encode_arrays(_) for _ in output['data']]
+    else:
+        output['data'] = [decode_arrays(_) for _ in output['data']]
+    return output
+
+
+def plotlyjs_source(option):
+    """ Value for include_plotlyjs of plotly.io from a command line option """
+    if option is None or option == 'cdn':
+        return 'cdn'
+    if option == 'inline':
+        return True
+    if option is True or option == 'directory' or \
+            (isinstance(option, str) and option.endswith('.js')):
+        return option
+    raise ValueError(f"Can not include plotly.js from '{option}', use cdn, inline, "
+                     "directory or the path to a plotly.js file ending in .js")
+
+
+def plotlyjs_binary(source, filename):
+    """ Whether the plotly.js included with source decodes typed arrays.
+        The CDN, inline and directory sources use the bundled plotly.js.
+        A local file is loaded relative to the HTML file and is only
+        trusted if its version can be read.
+    """
+    if not isinstance(source, str) or source in ('cdn', 'directory'):
+        return binary_supported()
+    path = source if os.path.isabs(source) else \
+        os.path.join(os.path.dirname(os.path.abspath(filename)), source)
+    version = local_plotlyjs_version(path)
+    return version is not None and binary_supported(version)
+
+
+def write_html(fig, filename, include_plotlyjs='cdn', webgl=True, post_script=None,
+               auto_open=False, **kwargs):
+    """ Write the figure to an HTML file.
+        include_plotlyjs is passed on to plotly.io.write_html and can be
+        'cdn', True to embed plotly.js, 'directory' or the path to a
+        plotly.js file. Arrays are written as typed arrays only if the
+        included plotly.js can decode them.
+    """
+    source = plotlyjs_source(include_plotlyjs)
+    fig = figure_dict(fig, webgl=webgl, binary=plotlyjs_binary(source, filename))
+    plotly.io.write_html(fig, filename,
+                         include_plotlyjs=source,
+                         post_script=post_script,
+                         auto_open=auto_open,
+                         validate=False,
+                         **kwargs)
@@ -1,9 +1,11 @@
 import pandas
 import numpy
 
+from .xvg import loadxvg
+
 def rmsf_to_df(xvg_file):
     """ Convert . xvg file containing RMSF to Pandas Data Frame """
-    data = numpy.loadtxt(xvg_file, comments=('#','@'))
+    data = loadxvg(xvg_file, dtype=numpy.float64)
     df = pandas.DataFrame(data, columns=('Residue', 'RMSF'))
     df['Residue'] = df['Residue'].astype(int)
     return df
\ No newline at end of file
@@ -14,6 +14,8 @@ from collections import Counter
 import pickle
 import statistics
 
+import numpy
+
 SECSTR_CODES = {'H':'α-helix',
                 'G':'3_10-helix',
                 'I':'π-helix',
@@ -24,6 +26,12 @@ SECSTR_CODES = {'H':'α-helix',
                 '~':'Loop',
 }
 
+SS_GROUPS = {'Helix': 'HGI',
+             'Sheet': 'EB',
+             'Turn + Bend': 'TS',
+             'Loop': '~',
+}
+
 
 def parse_dat(filename):
     """ Parse the DSSP data file """
@@ -55,14 +63,67 @@ def get_ss_percentage(ss_strings, start=0, end=None):
         output['Sheet'].append( (counter['E'] + counter['B']) * 100 / total )
         output['Turn + Bend'].append( (counter['T'] + counter['S']) * 100 / total )
         output['Loop'].append( (counter['~']) * 100 / total )
+    return format_ss_percentage({
+        structure: (statistics.mean(values), statistics.stdev(values))
+        for structure, values in output.items()
+    })
+
+
+def format_ss_percentage(mean_std):
+    """ Format the mean and standard deviation of each structure """
     output_string = ''
-    for structure in output.keys():
-        mean = statistics.mean(output[structure])
-        std = statistics.stdev(output[structure])
+    for structure, (mean, std) in mean_std.items():
         output_string += f'{structure:<12}: {mean:.2f} % +/- {std:.2f} %\n'
     return output_string
 
 
+def ss_percentage_per_frame(frames):
+    """ Percentage of each group in SS_GROUPS for every row of a
+        frames x residues array of DSSP codes (dtype S1 or uint8)
+    """
+    frames = numpy.asarray(frames).view(numpy.uint8)
+    output = {}
+    for structure, codes in SS_GROUPS.items():
+        is_structure = numpy.isin(frames, numpy.frombuffer(codes.encode(), dtype=numpy.uint8))
+        output[structure] = numpy.count_nonzero(is_structure, axis=1) * 100 / frames.shape[1]
+    return output
+
+
+def ss_percentage_in_frames(datasets, begin=0, end=None, start=0, stop=None):
+    """ Secondary structure percentages in each of the frames [begin, end)
+        of the DSSP data stored by 'md_davis collect', using the residues
+        [start, stop).
+
+        datasets is an HDF5 dataset for one chain or a list of them which
+        are joined along the residues. The frames are read one chunk at a
+        time, so only the chunks in the window are loaded.
+    """
+    if not isinstance(datasets, (list, tuple)):
+        datasets = [datasets]
+    num_frames = len(datasets[0])
+    end = num_frames if end is None else min(end, num_frames)
+    rows = datasets[0].chunks[0] if datasets[0].chunks else end - begin
+    rows = max(rows, 1)
+    output = {structure: [] for structure in SS_GROUPS}
+    for first in range(begin, end, rows):
+        last = min(first + rows, end)
+        block = numpy.hstack([dset[first:last] for dset in datasets])[:, start:stop]
+        for structure, percentage in ss_percentage_per_frame(block).items():
+            output[structure].append(percentage)
+    return {structure: numpy.concatenate(values) if values else numpy.zeros(0)
+            for structure, values in output.items()}
+
+
+def get_ss_percentage_in_frames(datasets, begin=0, end=None, start=0, stop=None):
+    """ Mean and standard deviation of the secondary structure percentages
+        over the frames [begin, end), see ss_percentage_in_frames
+    """
+    percentages = ss_percentage_in_frames(datasets, begin=begin, end=end,
+                                          start=start, stop=stop)
+    return {structure: (numpy.mean(values), numpy.std(values, ddof=1))
+            for structure, values in percentages.items()}
+
+
 def get_arguments():
     """ Get input and output filename from the commandline """
     parser = argparse.ArgumentParser(description='Calculate and plot the'
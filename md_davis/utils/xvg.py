@@ -0,0 +1,156 @@
+"""
+    Read the .xvg files written by Gromacs in a single pass.
+
+    The header (lines starting with '@' or '#') is parsed for the title,
+    axis labels and legends, and the numbers are parsed in one call to
+    numpy instead of line by line. Optionally, the parsed data is cached
+    in a .npz file next to the .xvg file. The cache is used without
+    reading the .xvg file if its size and modification time are
+    unchanged, and otherwise only if the hash of its contents matches.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import numpy
+
+COMMENT_CHARS = ('#', '@', '&')
+
+TITLE = re.compile(r'\s+title\s+\"(.+)\"')
+XLABEL = re.compile(r'\s+xaxis  label\s+\"(.+)\"')
+YLABEL = re.compile(r'\s+yaxis  label\s+\"(.+)\"')
+LEGEND = re.compile(r'\s+s(\d+)\s+legend\s+\"(.+)\"')
+
+
+def parse_header(header):
+    """ Parse the title, axis labels and legends from the header lines
+        with the leading '@' removed
+    """
+    output = {}
+    legend_dict = {}
+    for header_line in header:
+        title_match = TITLE.search(header_line)
+        xlabel_match = XLABEL.search(header_line)
+        ylabel_match = YLABEL.search(header_line)
+        legend_match = LEGEND.search(header_line)
+        if title_match:
+            output['title'] = title_match.group(1)
+        if xlabel_match:
+            output['xlabel'] = xlabel_match.group(1)
+        if ylabel_match:
+            output['ylabel'] = ylabel_match.group(1)
+        if legend_match:
+            label = legend_match.group(2).replace('\\s', ' ').replace('\\N', '')
+            legend_dict[int(legend_match.group(1))] = label
+    if legend_dict:
+        output['legend'] = legend_dict
+    return output
+
+
+def split_text(text):
+    """ Separate the header lines from the data in the text of an .xvg file """
+    # Gromacs writes the whole header before the data, so the data is
+    # usually one contiguous block which can be passed on as it is
+    header = []
+    position = 0
+    while position < len(text):
+        end = text.find('\n', position)
+        end = len(text) if end < 0 else end + 1
+        line = text[position:end]
+        if line.strip() and not line.lstrip().startswith(COMMENT_CHARS):
+            break
+        if line.startswith('@'):
+            header.append(line[1:])
+        position = end
+    body = text[position:]
+    if any('\n' + char in body for char in COMMENT_CHARS):
+        data_lines = []
+        for line in body.splitlines(keepends=True):
+            if line.lstrip().startswith(COMMENT_CHARS):
+                if line.startswith('@'):
+                    header.append(line[1:])
+            else:
+                data_lines.append(line)
+        body = ''.join(data_lines)
+    return header, body
+
+
+def parse_data(body):
+    """ Parse whitespace separated numbers into a 2D array """
+    body = body.lstrip()
+    end = body.find('\n')
+    num_columns = len(body[:end if end >= 0 else len(body)].split())
+    values = numpy.fromstring(body, dtype=numpy.float64, sep=' ')
+    if num_columns == 0:
+        return values.reshape(0, 0)
+    if len(values) % num_columns:
+        raise ValueError('The number of values in each row of the .xvg file is not the same')
+    return values.reshape(-1, num_columns)
+
+
+def cache_filename(filename):
+    """ Name of the sidecar cache file for an .xvg file """
+    return filename + '.cache.npz'
+
+
+def read_cache(cached):
+    """ Read the data, header and the signature of the .xvg file from a cache """
+    with numpy.load(cached) as npz:
+        data = npz['data']
+        header = json.loads(str(npz['header']))
+        signature = str(npz['digest']), int(npz['size']), int(npz['mtime'])
+    if 'legend' in header:
+        header['legend'] = {int(k): v for k, v in header['legend'].items()}
+    return data, header, signature
+
+
+def read_xvg(filename, dtype=numpy.single, usecols=None, cache=False):
+    """ Read an .xvg file and return the data along with the parsed header
+
+        The data is a 2D array (rows x columns), or a 1D array if there is
+        only a single column, like numpy.loadtxt. If cache is True, the
+        parsed data is saved next to the .xvg file and reused as long as
+        the contents of the file do not change.
+    """
+    data, header = None, None
+    if cache:
+        cached = cache_filename(filename)
+        status = os.stat(filename)
+        size, mtime = status.st_size, status.st_mtime_ns
+        try:
+            cached_data, cached_header, (cached_digest, cached_size, cached_mtime) = \
+                read_cache(cached)
+        except (OSError, KeyError, ValueError):
+            cached_digest = None
+        else:
+            if (cached_size, cached_mtime) == (size, mtime):
+                data, header = cached_data, cached_header
+
+    if data is None:
+        with open(filename, 'rb') as xvg_file:
+            content = xvg_file.read()
+        if cache:
+            digest = hashlib.sha1(content).hexdigest()
+            if digest == cached_digest:
+                # Touched or copied, but the contents are the same
+                data, header = cached_data, cached_header
+        if data is None:
+            header_lines, body = split_text(content.decode())
+            header = parse_header(header_lines)
+            data = parse_data(body)
+        if cache:
+            numpy.savez(cached, data=data, header=json.dumps(header),
+                        digest=digest, size=size, mtime=mtime)
+
+    if usecols is not None:
+        data = data[:, list(usecols)]
+    if data.ndim == 2 and data.shape[1] == 1:
+        data = data[:, 0]
+    return data.astype(dtype, copy=False), header
+
+
+def loadxvg(filename, dtype=numpy.single, usecols=None, cache=False):
+    """ Read only the data from an .xvg file """
+    return read_xvg(filename, dtype=dtype, usecols=usecols, cache=cache)[0]
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `md_davis collect`."""
+
+import warnings
+
+import h5py
+import mdtraj
+import numpy
+import pytest
+import scipy.stats
+
+from md_davis import collect
+
+
+def write_xvg(filename, data):
+    with open(filename, 'w') as xvg_file:
+        xvg_file.write('# gmx\n@    title "test"\n')
+        numpy.savetxt(xvg_file, data, fmt='%10.4f')
+
+
+def make_trajectory(num_frames=300, num_residues=6):
+    topology = mdtraj.Topology()
+    chain = topology.add_chain()
+    for _ in range(num_residues):
+        residue = topology.add_residue('ALA', chain)
+        for name, element in [('N', 'N'), ('CA', 'C'), ('C', 'C'), ('O', 'O')]:
+            topology.add_atom(name, mdtraj.element.get_by_symbol(element), residue)
+    rng = numpy.random.default_rng(1)
+    xyz = numpy.arange(num_residues * 4)[:, None] * [0.15, 0.02, 0.01] \
+        + rng.normal(scale=0.03, size=(num_frames, num_residues * 4, 3))
+    return mdtraj.Trajectory(xyz.astype(numpy.float32), topology,
+                             time=numpy.arange(num_frames) * 5.0)
+
+
+@pytest.fixture
+def inputs(tmp_path, monkeypatch):
+    """ Input files for collect and the first frame computed in each
+        call of iter_dihedrals
+    """
+    time = numpy.arange(100) * 10.0
+    files = {name: str(tmp_path / f'{name}.xvg') for name in ['rmsd', 'rg', 'dipoles', 'rmsf']}
+    write_xvg(files['rmsd'], numpy.column_stack([time, time / 1000]))
+    write_xvg(files['rg'], numpy.column_stack([time] + [time / 100] * 4))
+    write_xvg(files['dipoles'], numpy.column_stack([time] + [time / 10] * 4))
+    write_xvg(files['rmsf'], numpy.column_stack([numpy.arange(6), numpy.arange(6) / 10]))
+
+    trajectory = make_trajectory()
+    files['trajectory_data'] = trajectory
+    files['trajectory'] = str(tmp_path / 'traj.xtc')
+    files['structure'] = str(tmp_path / 'structure.pdb')
+    trajectory[0].save_pdb(files['structure'])
+    trajectory[:200].save_xtc(files['trajectory'])
+    files['hdf_file'] = str(tmp_path / 'data.h5')
+
+    skipped = []
+    iter_dihedrals = collect.iter_dihedrals
+
+    def recorded_iter_dihedrals(*args, skip=0, **kwargs):
+        skipped.append(skip)
+        return iter_dihedrals(*args, skip=skip, **kwargs)
+
+    monkeypatch.setattr(collect, 'iter_dihedrals', recorded_iter_dihedrals)
+    files['skipped'] = skipped
+    return files
+
+
+def run_collect(inputs, atoms='None', sd_block='1', begin='1', end='2', comment='first',
+                sequence='AAAAAA'):
+    collect.main(['collect',
+                  '--comment', comment,
+                  '--all_atom_rmsd', inputs['rmsd'], '--all_atom_rg', inputs['rg'],
+                  '--dipoles', inputs['dipoles'],
+                  '--rmsf', inputs['rmsf'], begin, end,
+                  '--trajectory', inputs['trajectory'], '--structure', inputs['structure'],
+                  '-c', '64', '-a', atoms, '--sd_block', sd_block,
+                  '--info', f"{{'sequence': '{sequence}'}}",
+                  inputs['hdf_file']])
+
+
+def stored_phi(inputs):
+    with h5py.File(inputs['hdf_file'], 'r') as hdf_file:
+        return hdf_file['dihedrals/phi'][...]
+
+
+def test_unchanged_inputs(inputs, capsys):
+    """ Nothing is collected again if the files and options are unchanged """
+    run_collect(inputs)
+    with h5py.File(inputs['hdf_file'], 'r') as hdf_file:
+        sources = {path: hdf_file[path].attrs['sources']
+                   for path in ['rmsd_rg/all_atom', 'dipole_moment', 'rmsf', 'dihedrals']}
+    capsys.readouterr()
+    run_collect(inputs)
+    output = capsys.readouterr().out
+    assert inputs['skipped'] == [0]
+    assert output.count('Skipping') == 4
+    with h5py.File(inputs['hdf_file'], 'r') as hdf_file:
+        for path, recorded in sources.items():
+            assert hdf_file[path].attrs['sources'] == recorded
+
+
+def test_extended_trajectory(inputs):
+    """ Only the new frames of an extended trajectory are computed """
+    run_collect(inputs)
+    trajectory = inputs['trajectory_data']
+    trajectory.save_xtc(inputs['trajectory'])
+    run_collect(inputs)
+    assert inputs['skipped'] == [0, 200]
+
+    saved = mdtraj.load(inputs['trajectory'], top=inputs['structure'])
+    numpy.testing.assert_allclose(stored_phi(inputs), mdtraj.compute_phi(saved)[1])
+    with h5py.File(inputs['hdf_file'], 'r') as hdf_file:
+        numpy.testing.assert_allclose(hdf_file['time'][...], saved.time)
+        psi_sd = hdf_file['dihedral_standard_deviation/chain 0']['psi'][:-1]
+    expected = scipy.stats.circstd(mdtraj.compute_psi(saved)[1], high=numpy.pi, axis=0)
+    numpy.testing.assert_allclose(psi_sd, expected, rtol=1e-5)
+
+
+def test_different_trajectory(inputs):
+    """ A trajectory which does not start with the stored frames is
+        computed again from the first frame
+    """
+    run_collect(inputs)
+    trajectory = inputs['trajectory_data']
+    trajectory[100:].save_xtc(inputs['trajectory'])
+    run_collect(inputs)
+    assert inputs['skipped'] == [0, 0]
+    saved = mdtraj.load(inputs['trajectory'], top=inputs['structure'])
+    numpy.testing.assert_allclose(stored_phi(inputs), mdtraj.compute_phi(saved)[1])
+
+
+def test_changed_sd_block(inputs):
+    """ A new --sd_block is evaluated from the stored dihedrals """
+    run_collect(inputs)
+    run_collect(inputs, sd_block='0.5')
+    assert inputs['skipped'] == [0]
+    saved = mdtraj.load(inputs['trajectory'], top=inputs['structure'])
+    psi = mdtraj.compute_psi(saved)[1]
+    with h5py.File(inputs['hdf_file'], 'r') as hdf_file:
+        blocks = hdf_file['dihedral_standard_deviation_blocks']
+        assert list(blocks.attrs['begin']) == [0, 0.5]
+        assert list(blocks.attrs['end']) == [0.5, 1]
+        for window, start in enumerate([0, 100]):
+            expected = scipy.stats.circstd(psi[start:start + 100], high=numpy.pi, axis=0)
+            numpy.testing.assert_allclose(blocks['chain 0']['psi'][window, :-1], expected,
+                                           rtol=1e-5)
+
+
+def test_changed_atoms(inputs):
+    """ The dihedrals are computed again for a different atom selection """
+    run_collect(inputs)
+    # The first four residues
+    run_collect(inputs, atoms=str(list(range(16))), sequence='AAAA')
+    assert inputs['skipped'] == [0, 0]
+    assert stored_phi(inputs).shape == (200, 3)
+
+
+def test_changed_options(inputs):
+    """ The RMSF begin and end and the comment are updated """
+    run_collect(inputs)
+    run_collect(inputs, begin='2', end='3', comment='second')
+    with h5py.File(inputs['hdf_file'], 'r') as hdf_file:
+        assert hdf_file['rmsf'].attrs['begin'] == '2 ns'
+        assert hdf_file['rmsf'].attrs['end'] == '3 ns'
+        assert hdf_file['rmsd_rg'].attrs['comment'] == 'second'
+
+
+def test_regenerated_xvg(inputs):
+    """ A regenerated .xvg file with different values replaces the data """
+    run_collect(inputs)
+    time = numpy.arange(120) * 10.0
+    write_xvg(inputs['rmsd'], numpy.column_stack([time, time / 500]))
+    write_xvg(inputs['rg'], numpy.column_stack([time] + [time / 100] * 4))
+    run_collect(inputs)
+    with h5py.File(inputs['hdf_file'], 'r') as hdf_file:
+        numpy.testing.assert_allclose(hdf_file['rmsd_rg/all_atom']['rmsd'],
+                                      time / 500, atol=1e-4)
+
+
+@pytest.mark.parametrize('extension', ['.xtc', '.pdb'])
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_iter_dihedrals_skip(tmp_path, extension, jobs):
+    """ The first frames are skipped also for formats mdtraj can not seek in """
+    trajectory = make_trajectory(num_frames=50)
+    filename = str(tmp_path / f'traj{extension}')
+    structure = str(tmp_path / 'structure.pdb')
+    trajectory.save(filename)
+    trajectory[0].save_pdb(structure)
+    saved = mdtraj.load(filename, top=structure)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        chunks = list(collect.iter_dihedrals(filename, structure, chunk=16,
+                                             jobs=jobs, skip=20))
+    numpy.testing.assert_allclose(numpy.concatenate([_[0] for _ in chunks]), saved.time[20:])
+    numpy.testing.assert_allclose(numpy.concatenate([_[1]['phi'][1] for _ in chunks]),
+                                  mdtraj.compute_phi(saved[20:])[1])
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `md_davis electrostatics batch` with stub executables."""
+
+import glob
+import os
+import stat
+import sys
+
+import mdtraj
+import numpy
+import pytest
+
+from md_davis.electrostatics.batch import batch_electrostatics
+
+
+PDB_TO_XYZRN = '''
+import sys
+for line in open(sys.argv[1]):
+    if line.startswith(('ATOM', 'HETATM')):
+        print(line[30:38], line[38:46], line[46:54], 1.5)
+'''
+
+# Two vertices next to every atom
+MSMS = '''
+import sys, numpy
+xyz = sys.argv[sys.argv.index('-if') + 1]
+basename = sys.argv[sys.argv.index('-of') + 1]
+atoms = numpy.loadtxt(xyz, ndmin=2)[:, :3]
+vertices = numpy.concatenate([atoms + [1.5, 0, 0], atoms - [0, 1.5, 0]])
+with open(basename + '.vert', 'w') as vert_file:
+    vert_file.write('# MSMS stub\\n#faces\\n%d 0 0 0\\n' % len(vertices))
+    for vertex in vertices:
+        vert_file.write('%9.3f %9.3f %9.3f    0.000    0.000    0.000       0       1  2\\n'
+                        % tuple(vertex))
+open(basename + '.face', 'w').close()
+'''
+
+# Writes a potential map and fails for the frames named in DELPHI_STUB_FAIL
+DELPHI = '''
+import os, re, sys, numpy
+parameters = open(sys.argv[1]).read()
+pdb_file = re.search(r'in\\(pdb,file="([^"]+)"\\)', parameters).group(1)
+if os.path.basename(pdb_file) in os.environ.get('DELPHI_STUB_FAIL', '').split():
+    sys.exit(1)
+cube_file = re.search(r'out\\(phi, file="([^"]+)"', parameters).group(1)
+size = 11
+with open(cube_file, 'w') as cube:
+    cube.write('stub\\ncube\\n   0 -20.000000 -20.000000 -20.000000\\n')
+    for axis in numpy.eye(3) * 8:
+        cube.write('%4d %.6f %.6f %.6f\\n' % (size, *axis))
+    cube.write(' '.join('%.5e' % _ for _ in numpy.arange(size ** 3)) + '\\n')
+'''
+
+
+def write_executable(filename, source):
+    with open(filename, 'w') as executable:
+        executable.write(f'#!{sys.executable}\n{source}')
+    os.chmod(filename, os.stat(filename).st_mode | stat.S_IXUSR)
+    return filename
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """ A trajectory of 10 frames with stub MSMS and Delphi executables """
+    stubs = tmp_path / 'stubs'
+    stubs.mkdir()
+    write_executable(stubs / 'pdb_to_xyzrn', PDB_TO_XYZRN)
+    write_executable(stubs / 'msms.x86_64Linux2.2.6.1', MSMS)
+    delphi = write_executable(stubs / 'delphi', DELPHI)
+
+    topology = mdtraj.Topology()
+    chain = topology.add_chain()
+    for _ in range(3):
+        residue = topology.add_residue('ALA', chain)
+        for name, element in [('N', 'N'), ('CA', 'C'), ('C', 'C'), ('O', 'O')]:
+            topology.add_atom(name, mdtraj.element.get_by_symbol(element), residue)
+    rng = numpy.random.default_rng(0)
+    xyz = numpy.arange(12)[:, None] * [0.15, 0.02, 0.01] \
+        + rng.normal(scale=0.02, size=(10, 12, 3))
+    trajectory = mdtraj.Trajectory(xyz.astype(numpy.float32), topology,
+                                   time=numpy.arange(10) * 10.0)
+    trajectory[0].save_pdb(str(tmp_path / 'structure.pdb'))
+    trajectory.save_xtc(str(tmp_path / 'traj.xtc'))
+    (tmp_path / 'radius.siz').touch()
+    (tmp_path / 'charge.crg').touch()
+
+    return dict(trajectory=str(tmp_path / 'traj.xtc'),
+                structure=str(tmp_path / 'structure.pdb'),
+                output_directory=str(tmp_path / 'output'),
+                delphi_path=str(delphi),
+                msms_path=str(stubs) + '/',
+                radius_file=str(tmp_path / 'radius.siz'),
+                charge_file=str(tmp_path / 'charge.crg'),
+                on_surface=True,
+                interpolate=True,
+                jobs=2)
+
+
+def test_frame_selection(inputs):
+    """ Frames from begin to before end with stride are calculated """
+    done, failed = batch_electrostatics(begin=2, end=8, stride=3, **inputs)
+    assert failed == {}
+    assert sorted(done) == ['traj_2', 'traj_5']
+    assert sorted(os.listdir(inputs['output_directory'])) == [
+        f'traj_{frame}{ext}' for frame in [2, 5] for ext in ['.cub', '.pdb', '.pot']]
+    with open(os.path.join(inputs['output_directory'], 'traj_5.pot')) as pot_file:
+        lines = pot_file.read().splitlines()
+    assert len(lines) == 12 + 2 * 12 + 2
+    # Titled with the name of the cube file, not its temporary directory
+    assert lines[2].strip() == 'traj_5.cub'
+
+
+def test_resume(inputs):
+    """ Frames with all their output files are skipped """
+    done, failed = batch_electrostatics(end=4, **inputs)
+    assert sorted(done) == ['traj_0', 'traj_1', 'traj_2', 'traj_3']
+    cube_file = os.path.join(inputs['output_directory'], 'traj_0.cub')
+    modified = os.path.getmtime(cube_file)
+
+    done, failed = batch_electrostatics(end=4, **inputs)
+    assert done == [] and failed == {}
+    assert os.path.getmtime(cube_file) == modified
+
+    os.remove(os.path.join(inputs['output_directory'], 'traj_2.pot'))
+    done, failed = batch_electrostatics(end=4, **inputs)
+    assert done == ['traj_2'] and failed == {}
+
+
+def test_failed_frame(inputs, monkeypatch):
+    """ A failed frame is reported and its directory is kept """
+    monkeypatch.setenv('DELPHI_STUB_FAIL', 'traj_1.pdb')
+    done, failed = batch_electrostatics(end=3, **inputs)
+    assert sorted(done) == ['traj_0', 'traj_2']
+    assert list(failed) == ['traj_1']
+    assert 'traj_1.cub' in str(failed['traj_1'])
+    output_directory = inputs['output_directory']
+    assert not glob.glob(os.path.join(output_directory, 'traj_1.*'))
+    kept = glob.glob(os.path.join(output_directory, '.traj_1.*'))
+    assert len(kept) == 1
+    assert os.path.isfile(os.path.join(kept[0], 'traj_1.pdb'))
+    assert not glob.glob(os.path.join(output_directory, '.traj_[02].*'))
+
+    # The directory of the failed attempt is removed once the frame is done
+    monkeypatch.delenv('DELPHI_STUB_FAIL')
+    done, failed = batch_electrostatics(end=3, **inputs)
+    assert done == ['traj_1'] and failed == {}
+    assert not glob.glob(os.path.join(output_directory, '.*'))
+
+
+def test_keep_failed_directories(inputs, monkeypatch):
+    """ With keep, the directories of failed attempts are not removed """
+    monkeypatch.setenv('DELPHI_STUB_FAIL', 'traj_1.pdb')
+    batch_electrostatics(end=2, **inputs)
+    monkeypatch.delenv('DELPHI_STUB_FAIL')
+    done, failed = batch_electrostatics(end=2, keep=True, **inputs)
+    assert done == ['traj_1']
+    assert len(glob.glob(os.path.join(inputs['output_directory'], '.traj_1.*'))) == 2
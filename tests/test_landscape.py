@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `md_davis.landscape.landscape`."""
+
+import h5py
+import numpy
+
+from md_davis.landscape.landscape import Landscape
+
+
+def concatenated_runs():
+    """ Two runs with the same times, the first in the lowest bin and the
+        second in the highest bin
+    """
+    time = numpy.concatenate([numpy.arange(4.0), numpy.arange(4.0)])
+    x_data = numpy.array([0, 0, 0, 0, 1, 1, 1, 1], dtype=float)
+    return Landscape.landscape('runs', time, x_data, x_data, shape=(2, 2))
+
+
+def random_landscape():
+    """ Energy landscape with errors of 1000 random points """
+    rng = numpy.random.default_rng(0)
+    time = numpy.arange(1000) * 10.0
+    landscape = Landscape.landscape('random', time, rng.normal(size=1000),
+                                    rng.normal(size=1000), shape=(10, 12),
+                                    label='Random <i>points</i>', temperature=300)
+    return landscape.bootstrap_errors(temperature=300, block_length=50,
+                                      replicates=10, seed=1)
+
+
+def save_old_layout(landscape, filename, name):
+    """ Save the landscape with one dataset of times per bin referenced
+        from the time_bins dataset, as written by earlier versions
+    """
+    with h5py.File(filename, 'a') as hdf_file:
+        grp = hdf_file.require_group('landscapes').create_group(name)
+        dset = grp.create_dataset('zValues', data=landscape.zValues)
+        dset.attrs['name'] = landscape.name
+        dset.attrs['label'] = landscape.label
+        dims_grp = grp.create_group('dimensions')
+        for axis in ['x', 'y', 'z']:
+            dims_grp.create_dataset(axis, data=landscape.dims[axis])
+        grp.create_dataset('xBins', data=landscape.xBins)
+        grp.create_dataset('yBins', data=landscape.yBins)
+        ref_dtype = h5py.special_dtype(ref=h5py.Reference)
+        t_dset = grp.create_dataset('time_bins', dset.shape, dtype=ref_dtype)
+        time_grp = grp.create_group('time_group')
+        for x, rows in enumerate(landscape.time_bins):
+            for y, time in enumerate(rows):
+                if len(time) > 0:
+                    t = time_grp.create_dataset(f'({landscape.xBins[x]}, {landscape.yBins[y]})',
+                                                data=numpy.array(time))
+                    t_dset[x, y] = t.ref
+
+
+def assert_same_landscape(opened, landscape):
+    assert opened.name == landscape.name
+    assert opened.label == landscape.label
+    for attr in ['zValues', 'xBins', 'yBins', 'bin_times', 'bin_offsets', 'bin_frames']:
+        numpy.testing.assert_array_equal(getattr(opened, attr), getattr(landscape, attr))
+    for axis in ['x', 'y', 'z']:
+        numpy.testing.assert_array_equal(opened.dims[axis], landscape.dims[axis])
+
+
+def test_save_open(tmp_path):
+    """ A saved landscape is opened with its errors and time index """
+    filename = str(tmp_path / 'landscapes.h5')
+    landscape = random_landscape()
+    landscape.save(filename, 'first', xlabel='x', ylabel='y')
+    empty = Landscape('empty', [0, 1], [0, 1])
+    empty.dims = dict(x=(0, 1), y=(0, 1), z=(0, 0))
+    empty.save(filename, 'second')
+
+    opened, opened_empty = Landscape.open(filename)
+    assert_same_landscape(opened, landscape)
+    numpy.testing.assert_array_equal(opened.zErrors, landscape.zErrors)
+    numpy.testing.assert_array_equal(opened.block_counts(50).toarray(),
+                                     landscape.block_counts(50).toarray())
+    assert_same_landscape(opened_empty, empty)
+    assert opened_empty.zErrors is None
+
+
+def test_open_old_layout(tmp_path):
+    """ Files with the times of each bin in their own dataset and without
+        frame indices are opened with the times in time order
+    """
+    filename = str(tmp_path / 'landscapes.h5')
+    landscape = random_landscape()
+    save_old_layout(landscape, filename, 'old')
+    landscape.save(filename, 'no_frames')
+    with h5py.File(filename, 'a') as hdf_file:
+        del hdf_file['landscapes/no_frames/bin_frames']
+
+    # The times increase with the frames
+    for opened in Landscape.open(filename):
+        assert_same_landscape(opened, landscape)
+        numpy.testing.assert_array_equal(opened.bin_time(3, 4), landscape.bin_time(3, 4))
+
+
+def test_blocks_in_frame_order():
+    """ Blocks of consecutive frames do not mix runs with the same times """
+    landscape = concatenated_runs()
+    blocks = landscape.block_counts(block_length=4).toarray()
+    numpy.testing.assert_array_equal(blocks, [[4, 0, 0, 0], [0, 0, 0, 4]])
+
+    # Added in two calls
+    landscape = Landscape('runs', landscape.xBins, landscape.yBins)
+    landscape.add_data(numpy.arange(4.0), numpy.zeros(4), numpy.zeros(4))
+    landscape.add_data(numpy.arange(4.0), numpy.ones(4), numpy.ones(4))
+    numpy.testing.assert_array_equal(landscape.block_counts(block_length=4).toarray(), blocks)
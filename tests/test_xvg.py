@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the .xvg reader in `md_davis.utils.xvg`."""
+
+import os
+
+import numpy
+import pytest
+
+from md_davis.utils import xvg
+
+
+XVG = '''# This file was created by gmx rms
+# Command line: gmx rms -f traj.xtc
+@    title "RMSD"
+@    xaxis  label "Time (ns)"
+@    yaxis  label "RMSD (nm)"
+@TYPE xy
+@ s0 legend "Backbone"
+@ s1 legend "C\\sAlpha\\N"
+   0.0000000    0.0005321   0.0004000
+   0.0100000    0.0621532   0.0512000
+# Restarted
+@ s2 legend "ignored"
+   0.0200000    0.0799384   0.0700000
+&
+   0.0300000    0.0812000   0.0800000
+'''
+
+
+def write(tmp_path, text, name='test.xvg'):
+    filename = str(tmp_path / name)
+    with open(filename, 'w') as xvg_file:
+        xvg_file.write(text)
+    return filename
+
+
+def loadtxt(filename, **kwargs):
+    return numpy.loadtxt(filename, comments=('#', '@', '&'), **kwargs)
+
+
+def test_same_as_loadtxt(tmp_path):
+    """ Comment, header and set separator lines anywhere are skipped """
+    filename = write(tmp_path, XVG)
+    data, header = xvg.read_xvg(filename, dtype=numpy.float64)
+    numpy.testing.assert_array_equal(data, loadtxt(filename))
+    assert header == {'title': 'RMSD', 'xlabel': 'Time (ns)', 'ylabel': 'RMSD (nm)',
+                      'legend': {0: 'Backbone', 1: 'C Alpha', 2: 'ignored'}}
+    numpy.testing.assert_array_equal(xvg.loadxvg(filename, dtype=numpy.float64, usecols=[0, 2]),
+                                     loadtxt(filename, usecols=[0, 2]))
+
+
+def test_single_column(tmp_path):
+    """ A single column is returned as a 1D array like numpy.loadtxt """
+    filename = write(tmp_path, '@ title "x"\n1.5\n2.5\n3.5\n')
+    data = xvg.loadxvg(filename, dtype=numpy.float64)
+    assert data.shape == (3,)
+    numpy.testing.assert_array_equal(data, loadtxt(filename))
+
+    filename = write(tmp_path, XVG)
+    data = xvg.loadxvg(filename, dtype=numpy.float64, usecols=[1])
+    numpy.testing.assert_array_equal(data, loadtxt(filename, usecols=[1]))
+
+
+def test_malformed_row(tmp_path):
+    """ A row with a missing value is an error """
+    filename = write(tmp_path, XVG.replace('0.0621532   0.0512000', '0.0621532'))
+    with pytest.raises(ValueError):
+        loadtxt(filename)
+    with pytest.raises(ValueError):
+        xvg.read_xvg(filename)
+
+
+def test_cache(tmp_path, monkeypatch):
+    """ The file is hashed only if its size or modification time change """
+    filename = write(tmp_path, XVG)
+    expected, _ = xvg.read_xvg(filename, cache=True)
+    assert os.path.exists(xvg.cache_filename(filename))
+
+    hashed = []
+    sha1 = xvg.hashlib.sha1
+
+    def recorded_sha1(content):
+        hashed.append(content)
+        return sha1(content)
+
+    monkeypatch.setattr(xvg.hashlib, 'sha1', recorded_sha1)
+    monkeypatch.setattr(xvg, 'parse_data', None)
+    data, header = xvg.read_xvg(filename, cache=True)
+    numpy.testing.assert_array_equal(data, expected)
+    assert header['legend'][1] == 'C Alpha'
+    assert hashed == []
+
+    # Same contents with a new modification time
+    status = os.stat(filename)
+    os.utime(filename, ns=(status.st_atime_ns, status.st_mtime_ns + 10 ** 9))
+    numpy.testing.assert_array_equal(xvg.read_xvg(filename, cache=True)[0], expected)
+    assert len(hashed) == 1
+    xvg.read_xvg(filename, cache=True)
+    assert len(hashed) == 1
+
+    # Different contents
+    monkeypatch.undo()
+    write(tmp_path, XVG.replace('0.0812000', '0.0912000'))
+    data, _ = xvg.read_xvg(filename, dtype=numpy.float64, cache=True)
+    assert data[-1, 1] == 0.0912